@@ -34,7 +34,7 @@ class Block:
             name, self.height, C.consensus2name[self.flag], "ORPHAN" if self.f_orphan else "",
             hexlify(self.hash).decode(), len(self.txs))
 
-    def __init__(self, binary=None, block=None):
+    def __init__(self, binary=None, block=None, blockhash=None):
         self.b = None
         # block id
         self.hash = None  # header sha256 hash
@@ -64,7 +64,7 @@ class Block:
 
         if binary:
             self.b = binary
-            self.deserialize()
+            self.deserialize(blockhash)
         elif block:
             self.version = block.get('version', 0)
             self.previous_hash = block['previous_hash']
@@ -88,11 +88,12 @@ class Block:
         self.hash = sha256(sha256(self.b).digest()).digest()
         assert len(self.b) == 80, 'Not correct header size [{}!={}]'.format(len(self.b), 80)
 
-    def deserialize(self):
+    def deserialize(self, blockhash=None):
+        # blockhash is key of database, no need to hash again
         assert len(self.b) == 80, 'Not correct header size [{}!={}]'.format(len(self.b), 80)
         self.version, self.previous_hash, self.merkleroot, self.time, self.bits, \
             self.nonce = struct_block.unpack(self.b)
-        self.hash = sha256(sha256(self.b).digest()).digest()
+        self.hash = blockhash or sha256(sha256(self.b).digest()).digest()
 
     def getinfo(self):
         r = OrderedDict()
@@ -1,6 +1,7 @@
 from bc4py.config import V, P, NewInfo, BlockChainError
 from bc4py.chain.checking.checkblock import check_block, check_block_time
 from bc4py.chain.checking.checktx import check_tx, check_tx_time
+from bc4py.chain.checking.utils import BlockContext
 from bc4py.chain.checking.signature import batch_sign_cashe, delete_signed_cashe
 from bc4py.database.builder import builder, user_account
 import threading
@@ -32,8 +33,9 @@ def new_insert_block(block, time_check=False):
                 check_block_time(block, fixed_delay)
             check_block(block)
             batch_sign_cashe(block.txs)
+            context = BlockContext(block)
             for tx in block.txs:
-                check_tx(tx=tx, include_block=block)
+                check_tx(tx=tx, include_block=block, context=context)
                 if time_check:
                     check_tx_time(tx)
             # Recode
@@ -66,5 +68,6 @@ def new_insert_block(block, time_check=False):
 __all__ = [
     "new_insert_block",
     "check_block", "check_block_time",
-    "check_tx", "check_tx_time"
+    "check_tx", "check_tx_time",
+    "BlockContext",
 ]
@@ -9,8 +9,8 @@ from binascii import hexlify
 import time
 
 
-def check_tx(tx, include_block):
-    # TXの正当性チェック
+def check_tx(tx, include_block, context=None):
+    # TXの正当性チェック, contextはBlock内で順に検査する場合
     f_inputs_origin_check = True
     f_amount_check = True
     f_signature_check = True
@@ -21,17 +21,17 @@ def check_tx(tx, include_block):
     # 共通検査
     if include_block:
         # tx is included block
-        if tx not in include_block.txs:
+        index = get_tx_index(tx, include_block, context)
+        if index is None:
             raise BlockChainError('Block not include the tx.')
         elif not (tx.time <= include_block.time <= tx.deadline):
             raise BlockChainError('block time isn\'t include in TX time-deadline. [{}<={}<={}]'
                                   .format(tx.time, include_block.time, tx.deadline))
-        if 0 == include_block.txs.index(tx):
+        if 0 == index:
             if tx.type not in (C.TX_POS_REWARD, C.TX_POW_REWARD):
                 raise BlockChainError('tx index is zero, but not proof tx.')
         elif tx.type in (C.TX_POS_REWARD, C.TX_POW_REWARD):
-            raise BlockChainError('{} index is not 0 idx:{}.'
-                                  .format(tx, include_block.txs.index(tx)))
+            raise BlockChainError('{} index is not 0 idx:{}.'.format(tx, index))
 
     # 各々のタイプで検査
     if tx.type == C.TX_GENESIS:
@@ -40,13 +40,13 @@ def check_tx(tx, include_block):
     elif tx.type == C.TX_POS_REWARD:
         f_amount_check = False
         f_minimum_fee_check = False
-        check_tx_pos_reward(tx=tx, include_block=include_block)
+        check_tx_pos_reward(tx=tx, include_block=include_block, context=context)
 
     elif tx.type == C.TX_POW_REWARD:
         f_amount_check = False
         f_signature_check = False
         f_minimum_fee_check = False
-        check_tx_pow_reward(tx=tx, include_block=include_block)
+        check_tx_pow_reward(tx=tx, include_block=include_block, context=context)
 
     elif tx.type == C.TX_TRANSFER:
         # feeに使用するCoinIDは0とは限らない
@@ -58,34 +58,34 @@ def check_tx(tx, include_block):
         f_amount_check = False
         f_minimum_fee_check = False
         f_signature_check = False
-        check_tx_mint_coin(tx=tx, include_block=include_block)
+        check_tx_mint_coin(tx=tx, include_block=include_block, context=context)
 
     elif tx.type == C.TX_VALIDATOR_EDIT:
         f_signature_check = False
         if tx.hash in tx_builder.unconfirmed:
             f_inputs_origin_check = False  # already checked before
-        check_tx_validator_edit(tx=tx, include_block=include_block)
+        check_tx_validator_edit(tx=tx, include_block=include_block, context=context)
 
     elif tx.type == C.TX_CONCLUDE_CONTRACT:
         f_signature_check = False
         if tx.hash in tx_builder.unconfirmed:
             f_inputs_origin_check = False  # already checked before
-        check_tx_contract_conclude(tx=tx, include_block=include_block)
+        check_tx_contract_conclude(tx=tx, include_block=include_block, context=context)
 
     else:
         raise BlockChainError('Unknown tx type "{}"'.format(tx.type))
 
     # Inputs origin チェック
     if f_inputs_origin_check:
-        inputs_origin_check(tx=tx, include_block=include_block)
+        inputs_origin_check(tx=tx, include_block=include_block, context=context)
 
     # 残高移動チェック
     if f_amount_check:
-        amount_check(tx=tx, payfee_coin_id=payfee_coin_id)
+        amount_check(tx=tx, payfee_coin_id=payfee_coin_id, context=context)
 
     # 署名チェック
     if f_signature_check:
-        signature_check(tx=tx)
+        signature_check(tx=tx, context=context)
 
     # Feeチェック
     if f_minimum_fee_check:
@@ -98,6 +98,8 @@ def check_tx(tx, include_block):
         if tx.size > C.SIZE_TX_LIMIT:
             raise BlockChainError('TX size is too large. [{}>{}]'.format(tx.size, C.SIZE_TX_LIMIT))
 
+    if context is not None:
+        context.add(tx)
     if include_block:
         logging.info("Checked tx {}".format(tx))
     else:
@@ -1,23 +1,192 @@
 from bc4py.config import V
 from nem_ed25519.key import get_address
 from nem_ed25519.signature import verify
+from nem_ed25519.utils import decodepoint, decodeint, encodepoint, Hint_hash, inverse, \
+    scalarmult_B, edwards_add, edwards_double, IDENT, PRIME, L, B, D
+from gmpy2 import powmod, jacobi
 from binascii import hexlify, unhexlify
-from threading import Lock
-from time import time, sleep
+from threading import Lock, Event
+from collections import OrderedDict
+from functools import lru_cache
 from pooled_multiprocessing import mp_map_async
+from os import urandom, cpu_count
 import logging
 
 
-verify_cashe = dict()  # {(pubkey, signature, txhash): address, ...}
-limit_time = time()
-limit_delete_set = set()
+MAX_CASHE_SIZE = 20000  # txs
+BATCH_VERIFY_SIZE = 64  # max signatures of one batch task
+BATCH_VERIFY_MIN = 4
+WNAF_WIDTH = 5  # odd multiples table P,3P,..,15P
+SQRT_M1 = powmod(2, (PRIME - 1) // 4, PRIME)
+WAIT_TIMEOUT = 10  # Sec
+WAIT_RETRY = 3
+verify_cashe = OrderedDict()  # {txhash: SignedTX, ...} LRU order
 lock = Lock()
 
 
+class SignedTX:
+    __slots__ = ("signed", "pending", "event")
+
+    def __init__(self):
+        self.signed = dict()  # {(pubkey, signature): address or error or None}
+        self.pending = 0
+        self.event = Event()
+        self.event.set()
+
+    def __repr__(self):
+        return "<SignedTX {}/{}>".format(len(self.signed) - self.pending, len(self.signed))
+
+    def put(self, pair):
+        # now verifying
+        self.signed[pair] = None
+        self.pending += 1
+        self.event.clear()
+
+    def done(self, pair, address):
+        if pair not in self.signed or self.signed[pair] is not None:
+            return  # already done or reset
+        self.signed[pair] = address
+        self.pending -= 1
+        if self.pending == 0:
+            self.event.set()
+
+    def reset(self):
+        # forget results not returned, verify again
+        for pair, address in list(self.signed.items()):
+            if address is None:
+                del self.signed[pair]
+        self.pending = 0
+        self.event.set()
+
+
+@lru_cache(maxsize=4096)
+def _pubkey2address(pubkey, prefix):
+    return get_address(pk=pubkey, prefix=prefix)
+
+
+@lru_cache(maxsize=4096)
+def _pubkey2point(pubkey):
+    # return point or None if not usable for batch verify
+    try:
+        A = decodepoint(unhexlify(pubkey.encode()))
+    except Exception:
+        return None
+    return A if _is_torsion_free(A) else None
+
+
+def _wnaf(k):
+    # signed digits, non zero digit is odd and |d| < 2**(w-1)
+    digits = list()
+    while k:
+        if k & 1:
+            d = k & ((1 << WNAF_WIDTH) - 1)
+            if d >= 1 << (WNAF_WIDTH - 1):
+                d -= 1 << WNAF_WIDTH
+            k -= d
+        else:
+            d = 0
+        digits.append(d)
+        k >>= 1
+    return digits
+
+
+def _multi_scalarmult(pairs):
+    # Straus's method with wNAF, sum of k*P with shared doublings
+    adds = dict()  # {bit: [point,..]}
+    for P, k in pairs:
+        P2 = edwards_double(P)
+        table = [P]
+        for i in range(1, 1 << (WNAF_WIDTH - 2)):
+            table.append(edwards_add(table[-1], P2))
+        for i, d in enumerate(_wnaf(k)):
+            if d > 0:
+                adds.setdefault(i, list()).append(table[d >> 1])
+            elif d < 0:
+                x, y, z, t = table[-d >> 1]
+                adds.setdefault(i, list()).append((-x % PRIME, y, z, -t % PRIME))
+    Q = IDENT
+    for i in reversed(range(max(adds, default=-1) + 1)):
+        Q = edwards_double(Q)
+        for P in adds.get(i, ()):
+            Q = edwards_add(Q, P)
+    return Q
+
+
+def _sqrt_ratio(u, v):
+    # sqrt(u/v) or None, PRIME = 5 mod 8
+    v3 = v * v * v % PRIME
+    x = u * v3 * powmod(u * v3 * v3 * v, (PRIME - 5) // 8, PRIME) % PRIME
+    vxx = v * x * x % PRIME
+    if vxx == u % PRIME:
+        return x
+    elif vxx == -u % PRIME:
+        return x * SQRT_M1 % PRIME
+    return None
+
+
+def _is_torsion_free(P):
+    # same as L*P is identity, P is in 8*E because E = Z8 x ZL
+    # halve P three times, half of (x, y) has y^2 = t with d(1+y)t^2 + 2(1-dy)t - (1+y) = 0
+    x, y, z, t = P
+    if z != 1:
+        zi = inverse(z)
+        x, y = x * zi % PRIME, y * zi % PRIME
+    if x % PRIME == 0:
+        return y % PRIME == 1
+    for i in range(3):
+        b = (1 - D * y) % PRIME
+        den = D * (1 + y) % PRIME
+        s = _sqrt_ratio(b * b + D * (1 + y) * (1 + y), 1)
+        if s is None:
+            return False
+        for num in ((s - b) % PRIME, (-s - b) % PRIME):
+            # rational half needs y^2 = num/den and x^2 = (num-den)/(d*num+den) are square
+            if num != 0 and jacobi(num * den % PRIME, PRIME) != 1:
+                continue
+            if jacobi((num - den) * (D * num + den) % PRIME, PRIME) != 1:
+                continue
+            break
+        else:
+            return False
+        if i < 2:
+            y = _sqrt_ratio(num, den)
+    return True
+
+
+def _batch_verify(tasks, prefix):
+    # randomized batch verification, sum(z*S)*B == sum(z*R) + sum(z*h*A)
+    # R and A are torsion free, so same result with verify() of each signature
+    try:
+        pairs = list()
+        s_sum = 0
+        for pubkey, signature, txhash, tx_b in tasks:
+            A = _pubkey2point(pubkey)
+            if A is None or len(signature) != B // 4:
+                raise ValueError('Not batch verifiable pubkey or signature.')
+            R = decodepoint(signature[:B // 8])
+            if not _is_torsion_free(R):
+                raise ValueError('Not torsion free R.')
+            S = decodeint(signature[B // 8:B // 4])
+            h = Hint_hash(encodepoint(R) + unhexlify(pubkey.encode()) + tx_b)
+            z = int.from_bytes(urandom(16), 'little')
+            pairs.append((R, z))
+            pairs.append((A, z * h % L))
+            s_sum += z * S
+        x1, y1, z1, t1 = scalarmult_B(s_sum % L)
+        x2, y2, z2, t2 = _multi_scalarmult(pairs)
+        if (x1 * z2 - x2 * z1) % PRIME == 0 and (y1 * z2 - y2 * z1) % PRIME == 0:
+            return [(pubkey, signature, txhash, _pubkey2address(pubkey, prefix))
+                    for pubkey, signature, txhash, tx_b in tasks]
+        logging.debug("Failed batch verify {}sign, check one by one.".format(len(tasks)))
+    except Exception as e:
+        logging.debug("Failed batch verify {}sign, check one by one. \"{}\"".format(len(tasks), e))
+    return [_verify(*task, prefix=prefix) for task in tasks]
+
+
 def _verify(pubkey, signature, txhash, tx_b, prefix):
     try:
         verify(msg=tx_b, sign=signature, pk=pubkey)
-        address = get_address(pk=pubkey, prefix=prefix)
+        address = _pubkey2address(pubkey, prefix)
         return pubkey, signature, txhash, address
     except ValueError:
         error = "Failed verify tx {}".format(hexlify(txhash).decode())
@@ -29,27 +198,33 @@ def _verify(pubkey, signature, txhash, tx_b, prefix):
 
 
 def _callback(signed_list):
-    try:
-        with lock:
-            for pubkey, signature, txhash, address in signed_list:
-                verify_cashe[(pubkey, signature, txhash)] = address
-    except Exception as e:
-        logging.error("{}: {}".format(e, signed_list))
+    if isinstance(signed_list[0], str):
+        # waiters are timeout and retry
+        logging.error("Callback error, {}".format(signed_list[0]))
+        return
+    with lock:
+        for pubkey, signature, txhash, address in signed_list:
+            signed_tx = verify_cashe.get(txhash)
+            if signed_tx is not None:
+                signed_tx.done((pubkey, signature), address)
     logging.debug("Callback finish {}sign".format(len(signed_list)))
 
 
-def _delete_cashe():
-    global limit_time
-    del_num = 0
-    with lock:
-        for item in limit_delete_set:
-            if item in verify_cashe:
-                del verify_cashe[item]
-                del_num += 1
-        logging.debug("VerifyCash fleshed [{}/{}]".format(del_num, len(limit_delete_set)))
-        limit_delete_set.clear()
-        limit_delete_set.update(verify_cashe.keys())
-        limit_time = time()
+def _batch_callback(signed_lists):
+    if isinstance(signed_lists[0], str):
+        _callback(signed_lists)
+    else:
+        _callback([signed for signed_list in signed_lists for signed in signed_list])
+
+
+def _evict_cashe():
+    # with lock, remove old txs not verifying
+    for i in range(len(verify_cashe)):
+        if len(verify_cashe) <= MAX_CASHE_SIZE:
+            break
+        txhash, signed_tx = verify_cashe.popitem(last=False)
+        if signed_tx.pending > 0:
+            verify_cashe[txhash] = signed_tx
 
 
 def batch_sign_cashe(txs):
@@ -58,74 +233,61 @@ def batch_sign_cashe(txs):
     # list need to verify
     with lock:
         for tx in txs:
+            signed_tx = verify_cashe.get(tx.hash)
+            if signed_tx is None:
+                signed_tx = verify_cashe[tx.hash] = SignedTX()
+            else:
+                verify_cashe.move_to_end(tx.hash)
             for pubkey, signature in tx.signature:
-                if (pubkey, signature, tx.hash) not in verify_cashe:
+                if (pubkey, signature) not in signed_tx.signed:
                     generate_list.append((pubkey, signature, tx.hash, tx.b))
-                    verify_cashe[(pubkey, signature, tx.hash)] = None
-        # throw verify
-        if len(generate_list) == 0:
-            return
-        elif len(generate_list) == 1:
-            pubkey, signature, txhash, tx_b = generate_list[0]
-            pubkey, signature, txhash, address = _verify(pubkey, signature, txhash, tx_b, V.BLOCK_PREFIX)
-            verify_cashe[(pubkey, signature, txhash)] = address
-        else:
-            mp_map_async(_verify, generate_list, callback=_callback, prefix=V.BLOCK_PREFIX)
-            logging.debug("Put task {}sign to pool.".format(len(generate_list)))
+                    signed_tx.put((pubkey, signature))
+        _evict_cashe()
+    # throw verify
+    if len(generate_list) == 0:
+        return
+    elif len(generate_list) == 1:
+        pubkey, signature, txhash, tx_b = generate_list[0]
+        _callback([_verify(pubkey, signature, txhash, tx_b, V.BLOCK_PREFIX)])
+    else:
+        # split to use all workers
+        size = -(-len(generate_list) // (cpu_count() or 1))
+        size = min(BATCH_VERIFY_SIZE, max(BATCH_VERIFY_MIN, size))
+        tasks = [(generate_list[i:i+size],) for i in range(0, len(generate_list), size)]
+        mp_map_async(_batch_verify, tasks, callback=_batch_callback, prefix=V.BLOCK_PREFIX)
+        logging.debug("Put task {}sign {}batch to pool.".format(len(generate_list), len(tasks)))
 
 
 def get_signed_cks(tx):
-    failed = 200
-    while failed > 0:
-        try:
-            signed_cks = set()
-            for pubkey, signature, txhash in verify_cashe.keys():
-                if txhash != tx.hash:
-                    continue
-                if (pubkey, signature) not in tx.signature:
-                    continue
-                address = verify_cashe[(pubkey, signature, txhash)]
-                if address is None:
-                    failed -= 1
-                    sleep(0.02)
-                    break  # retry
-                signed_cks.add(address)
-            else:
-                if len(signed_cks) == len(tx.signature):
-                    return signed_cks
-                elif len(signed_cks) == 0:
-                    batch_sign_cashe([tx])
-                    failed -= 1
-                    continue
-                elif len(signed_cks) < len(tx.signature):
-                    logging.debug('Cannot get all signature, throw task. signed={}, include={}'
-                                    .format(signed_cks, len(tx.signature)))
-                    batch_sign_cashe([tx])
-                    failed -= 1
-                    sleep(0.02)
-                    continue
-                else:
-                    raise Exception('Something wrong. signed={}, include={}'
-                                    .format(signed_cks, len(tx.signature)))
-        except RuntimeError:
-            # dictionary changed size during iteration
-            failed -= 1
-            sleep(0.02)
+    # block until all signatures of tx verified
+    for i in range(WAIT_RETRY):
+        batch_sign_cashe([tx])
+        with lock:
+            signed_tx = verify_cashe.get(tx.hash)
+        if signed_tx is None:
+            continue  # deleted
+        if not signed_tx.event.wait(timeout=WAIT_TIMEOUT):
+            logging.debug("Timeout verify signature, retry. {} {}".format(tx, signed_tx))
+            with lock:
+                signed_tx.reset()
+            continue
+        with lock:
+            signed = [signed_tx.signed.get(pair) for pair in tx.signature]
+        if None not in signed:
+            return set(signed)
     raise Exception("Too match failed get signed_cks.")
 
 
 def delete_signed_cashe(txhash_set):
     want_delete_num = 0
     with lock:
-        for pair in verify_cashe.copy():
-            pubkey, signature, txhash = pair
-            if txhash in txhash_set and pair in verify_cashe:
-                del verify_cashe[pair]
+        for txhash in txhash_set:
+            signed_tx = verify_cashe.get(txhash)
+            if signed_tx is not None and signed_tx.pending == 0:
+                del verify_cashe[txhash]
                 want_delete_num += 1
     if want_delete_num > 0:
         logging.debug("VerifyCash delete [{}/{}]".format(want_delete_num, len(verify_cashe)))
-    if limit_time < time() - 10800:
-        _delete_cashe()
 
 
 __all__ = [
@@ -2,6 +2,7 @@ from bc4py.config import C, V, P, BlockChainError
 from bc4py.chain.block import Block
 from bc4py.chain.tx import TX
 from bc4py.chain.checking.signature import *
+from bc4py.chain.checking.utils import get_input_tx
 from bc4py.database.builder import tx_builder
 from bc4py.database.validator import *
 from bc4py.database.contract import *
@@ -10,7 +11,7 @@ from binascii import hexlify
 import bjson
 
 
-def check_tx_contract_conclude(tx: TX, include_block: Block):
+def check_tx_contract_conclude(tx: TX, include_block: Block, context=None):
     # common check
     if not (len(tx.inputs) > 0 and len(tx.inputs) > 0):
         raise BlockChainError('No inputs or outputs.')
@@ -37,7 +38,7 @@ def check_tx_contract_conclude(tx: TX, include_block: Block):
         raise BlockChainError('Already start_hash used. {}'.format(hexlify(check_finish_hash).decode()))
     # inputs address check
     for txhash, txindex in tx.inputs:
-        input_tx = tx_builder.get_tx(txhash)
+        input_tx = get_input_tx(txhash, context)
         if input_tx is None:
             raise BlockChainError('Not found input tx.')
         address, coin_id, amount = input_tx.outputs[txindex]
@@ -48,7 +49,7 @@ def check_tx_contract_conclude(tx: TX, include_block: Block):
     if v.require == 0:
         raise BlockChainError('At least 1 validator required. {}'.format(v.require))
     # check start tx
-    start_tx = tx_builder.get_tx(txhash=start_hash)
+    start_tx = get_input_tx(start_hash, context)
     if start_tx is None:
         raise BlockChainError('Not found start tx. {}'.format(hexlify(start_hash).decode()))
     if start_tx.height is None:
@@ -103,7 +104,7 @@ def check_tx_contract_conclude(tx: TX, include_block: Block):
     contract_signature_check(extra_tx=tx, v=v, include_block=include_block)
 
 
-def check_tx_validator_edit(tx: TX, include_block: Block):
+def check_tx_validator_edit(tx: TX, include_block: Block, context=None):
     # common check
     if not (len(tx.inputs) > 0 and len(tx.inputs) > 0):
         raise BlockChainError('No inputs or outputs.')
@@ -120,7 +121,7 @@ def check_tx_validator_edit(tx: TX, include_block: Block):
         raise BlockChainError('BjsonError: {}'.format(e))
     # inputs/outputs address check
     for txhash, txindex in tx.inputs:
-        input_tx = tx_builder.get_tx(txhash)
+        input_tx = get_input_tx(txhash, context)
         if input_tx is None:
             raise BlockChainError('Not found input tx.')
         address, coin_id, amount = input_tx.outputs[txindex]
@@ -1,18 +1,18 @@
 from bc4py.config import C, V, BlockChainError
 from bc4py.chain.checking.signature import *
+from bc4py.chain.checking.utils import get_input_tx, get_tx_index
 from bc4py.database.mintcoin import *
-from bc4py.database.builder import tx_builder
 from bc4py.user import CoinObject
 from binascii import hexlify
 import bjson
 
 
-def check_tx_mint_coin(tx, include_block):
+def check_tx_mint_coin(tx, include_block, context=None):
     if not (0 < len(tx.inputs) and 0 < len(tx.outputs)):
         raise BlockChainError('Input and output is more than 1.')
     elif tx.message_type != C.MSG_BYTE:
         raise BlockChainError('TX_MINT_COIN message is bytes.')
-    elif include_block and 0 == include_block.txs.index(tx):
+    elif include_block and 0 == get_tx_index(tx, include_block, context):
         raise BlockChainError('tx index is not proof tx.')
     elif tx.gas_amount < tx.size + len(tx.signature)*C.SIGNATURE_GAS + C.MINTCOIN_GAS:
         raise BlockChainError('Insufficient gas amount [{}<{}+{}+{}]'
@@ -27,7 +27,7 @@ def check_tx_mint_coin(tx, include_block):
     if isinstance(result, str):
         raise BlockChainError('Failed check mintcoin block={}: {}'.format(include_block, result))
     # signature check
-    require_cks, coins = input_output_digest(tx=tx)
+    require_cks, coins = input_output_digest(tx=tx, context=context)
     owner_address = m_before.address
     if owner_address:
         require_cks.add(owner_address)
@@ -56,11 +56,11 @@ def check_tx_mint_coin(tx, include_block):
             raise BlockChainError('Too many output amount. {}'.format(coins))
 
 
-def input_output_digest(tx):
+def input_output_digest(tx, context=None):
     require_cks = set()
     coins = CoinObject()
     for txhash, txindex in tx.inputs:
-        input_tx = tx_builder.get_tx(txhash=txhash)
+        input_tx = get_input_tx(txhash, context)
         if input_tx is None:
             raise BlockChainError('input tx is None. {}:{}'.format(hexlify(txhash).decode(), txindex))
         address, coin_id, amount = input_tx.outputs[txindex]
@@ -2,13 +2,14 @@ from bc4py import __chain_version__
 from bc4py.config import C, BlockChainError
 from bc4py.chain.utils import GompertzCurve
 from bc4py.database.builder import tx_builder
+from bc4py.chain.checking.utils import get_tx_index
 from binascii import hexlify
 
 
-def check_tx_pow_reward(tx, include_block):
+def check_tx_pow_reward(tx, include_block, context=None):
     if not (len(tx.inputs) == 0 and len(tx.outputs) == 1):
         raise BlockChainError('Inout is 0, output is 1 len.')
-    elif include_block.txs.index(tx) != 0:
+    elif get_tx_index(tx, include_block, context) != 0:
         raise BlockChainError('Proof tx is index 0.')
     elif not (tx.gas_price == 0 and tx.gas_amount == 0):
         raise BlockChainError('Pow gas info is wrong. [{}, {}]'.format(tx.gas_price, tx.gas_amount))
@@ -31,11 +32,11 @@ def check_tx_pow_reward(tx, include_block):
                               .format(include_block.difficulty, include_block.work_difficulty))
 
 
-def check_tx_pos_reward(tx, include_block):
+def check_tx_pos_reward(tx, include_block, context=None):
     # POS報酬TXの検査
     if not (len(tx.inputs) == len(tx.outputs) == 1):
         raise BlockChainError('Inputs and outputs is only 1 len.')
-    elif include_block.txs.index(tx) != 0:
+    elif get_tx_index(tx, include_block, context) != 0:
         raise BlockChainError('Proof tx is index 0.')
     elif not (tx.gas_price == 0 and tx.gas_amount == 0):
         raise BlockChainError('Pos gas info is wrong. [{}, {}]'.format(tx.gas_price, tx.gas_amount))
@@ -11,15 +11,56 @@ from collections import deque
 sticky_failed_txhash = deque(maxlen=20)
 
 
-def inputs_origin_check(tx, include_block):
+class BlockContext:
+    """ check txs of a block in order against the parent state """
+    __slots__ = ("block", "positions", "txs", "spent")
+
+    def __init__(self, block):
+        self.block = block
+        self.positions = dict()  # {txhash: index} first position in the block
+        for index, tx in enumerate(block.txs):
+            self.positions.setdefault(tx.hash, index)
+        self.txs = dict()  # {txhash: tx} checked txs of the block
+        self.spent = set()  # {(txhash, txindex),..} spent by checked txs
+
+    def __repr__(self):
+        return "<BlockContext {} checked={}>".format(self.block, len(self.txs))
+
+    def add(self, tx):
+        self.txs[tx.hash] = tx
+        for txhash, txindex in tx.inputs:
+            self.spent.add((txhash, txindex))
+
+
+def get_tx_index(tx, include_block, context=None):
+    # position of tx in the block or None
+    if context is not None:
+        return context.positions.get(tx.hash)
+    elif tx in include_block.txs:
+        return include_block.txs.index(tx)
+    return None
+
+
+def get_input_tx(txhash, context=None):
+    # include txs of same block, not on mempool
+    if context is not None and txhash in context.txs:
+        return context.txs[txhash]
+    return tx_builder.get_tx(txhash)
+
+
+def inputs_origin_check(tx, include_block, context=None):
     # Blockに取り込まれているなら
     # TXのInputsも既に取り込まれているはずだ
     limit_height = builder.best_block.height - C.MATURE_HEIGHT
     for txhash, txindex in tx.inputs:
-        input_tx = tx_builder.get_tx(txhash)
+        input_tx = get_input_tx(txhash, context)
         if input_tx is None:
             # InputのOriginが存在しない
             raise BlockChainError('Not found input tx. {}:{}'.format(hexlify(txhash).decode(), txindex))
+        elif context is not None and txhash in context.txs:
+            # 同一Block内のTX
+            if input_tx.type in (C.TX_POS_REWARD, C.TX_POW_REWARD):
+                raise BlockChainError('input origin is proof tx of same block.')
         elif input_tx.height is None:
             # InputのOriginはUnconfirmed
             if include_block:
@@ -40,7 +81,12 @@ def inputs_origin_check(tx, include_block):
             raise BlockChainError('1 Input of {} is already used! {}:{}'
                                   .format(tx, hexlify(txhash).decode(), txindex))
         # 同一Block内で使用されていないかチェック
-        if include_block:
+        if context is not None:
+            if (txhash, txindex) in context.spent:
+                sticky_failed_txhash.append(tx.hash)
+                raise BlockChainError('2 Input of {} is already used in same block {}:{}'
+                                      .format(tx, hexlify(txhash).decode(), txindex))
+        elif include_block:
             for input_tx in include_block.txs:
                 if input_tx == tx:
                     break
@@ -51,11 +97,11 @@ def inputs_origin_check(tx, include_block):
                                               .format(tx, input_tx))
 
 
-def amount_check(tx, payfee_coin_id):
+def amount_check(tx, payfee_coin_id, context=None):
     # Inputs
     input_coins = CoinObject()
     for txhash, txindex in tx.inputs:
-        input_tx = tx_builder.get_tx(txhash)
+        input_tx = get_input_tx(txhash, context)
         if input_tx is None:
             raise BlockChainError('Not found input tx {}'.format(hexlify(txhash).decode()))
         address, coin_id, amount = input_tx.outputs[txindex]
@@ -78,10 +124,10 @@ def amount_check(tx, payfee_coin_id):
                               .format(remain_amount, input_coins, output_coins, fee_coins))
 
 
-def signature_check(tx):
+def signature_check(tx, context=None):
     need_cks = set()
     for txhash, txindex in tx.inputs:
-        input_tx = tx_builder.get_tx(txhash)
+        input_tx = get_input_tx(txhash, context)
         if input_tx is None:
             raise BlockChainError('Not found input tx {}'.format(hexlify(txhash).decode()))
         address, coin_id, amount = input_tx.outputs[txindex]
@@ -97,6 +143,9 @@ def signature_check(tx):
 
 __all__ = [
     "sticky_failed_txhash",
+    "BlockContext",
+    "get_tx_index",
+    "get_input_tx",
     "inputs_origin_check",
     "amount_check",
     "signature_check",
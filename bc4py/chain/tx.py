@@ -18,9 +18,9 @@ struct_outputs = struct.Struct('<40sIQ')
 class TX:
     __slots__ = (
         "b", "hash", "height", "pos_amount",
-        "version", "type", "time", "deadline", "inputs", "outputs",
-        "gas_price", "gas_amount", "message_type", "message",
-        "signature", "f_on_memory", "__weakref__")
+        "version", "type", "time", "deadline", "_inputs", "_outputs",
+        "gas_price", "gas_amount", "message_type", "_message",
+        "signature", "f_on_memory", "_lazy", "__weakref__")
 
     def __eq__(self, other):
         return self.hash == other.hash
@@ -32,7 +32,8 @@ class TX:
         return "<TX {} {} {}>".format(
             self.height, C.txtype2name.get(self.type, None), hexlify(self.hash).decode())
 
-    def __init__(self, binary=None, tx=None):
+    def __init__(self, binary=None, tx=None, txhash=None):
+        self._lazy = False  # inputs, outputs and message are not decoded yet
         self.b = None
         # tx id
         self.hash = None
@@ -55,7 +56,14 @@ class TX:
         # 処理には使わないが有用なデータ
         self.f_on_memory = None
 
-        if binary:
+        if binary and txhash:
+            # from database, trust hash of the key and decode body when used
+            self.b = binary
+            self.hash = txhash
+            self.version, self.type, self.time, self.deadline, self.gas_price, self.gas_amount, \
+                self.message_type = struct_tx_header.unpack_from(binary)[:7]
+            self._lazy = True
+        elif binary:
             self.b = binary
             self.deserialize()
         elif tx:
@@ -72,6 +80,16 @@ class TX:
             self.serialize()
         self.signature = list()
 
+    def __setstate__(self, state):
+        # (None, {slot: value}) by slots, old pickle has inputs/outputs/message keys
+        if isinstance(state, tuple):
+            state = dict(state[0] or {}, **(state[1] or {}))
+        self._lazy = False
+        for name, value in state.items():
+            if name in ('inputs', 'outputs', 'message'):
+                name = '_' + name
+            setattr(self, name, value)
+
     def serialize(self):
         # 構造
         # [version I]-[type I]-[time I]-[deadline I]-[gas_price Q]-[gas_amount q]-[msg_type B]-
@@ -91,29 +109,76 @@ class TX:
         self.hash = sha256(sha256(self.b).digest()).digest()
 
     def deserialize(self, first_pos=0, f_raise=True):
+        self._lazy = False
         self.version, self.type, self.time, self.deadline, self.gas_price, self.gas_amount,\
             self.message_type, input_len, outputs_len, msg_len = struct_tx_header.unpack_from(self.b, first_pos)
+        pos = self._deserialize_body(first_pos, input_len, outputs_len, msg_len)
+        if len(self.b) != pos - first_pos:
+            if f_raise:
+                raise BlockChainError('Do not match len [{}!={}'.format(len(self.b), pos))
+            else:
+                self.b = self.b[first_pos:pos]
+        self.hash = sha256(sha256(self.b).digest()).digest()
+
+    def _deserialize_body(self, first_pos, input_len, outputs_len, msg_len):
         # inputs
         pos = first_pos + struct_tx_header.size
-        self.inputs = list()
-        for i in range(input_len):
-            self.inputs.append(struct_inputs.unpack_from(self.b, pos))
-            pos += struct_inputs.size
+        self._inputs = [struct_inputs.unpack_from(self.b, pos + struct_inputs.size * i)
+                        for i in range(input_len)]
+        pos += struct_inputs.size * input_len
         # outputs
-        self.outputs = list()
+        self._outputs = list()
         for i in range(outputs_len):
             address, coin_id, amount = struct_outputs.unpack_from(self.b, pos)
-            self.outputs.append((address.decode(), coin_id, amount))
+            self._outputs.append((address.decode(), coin_id, amount))
             pos += struct_outputs.size
         # msg
-        self.message = self.b[pos:pos+msg_len]
+        self._message = self.b[pos:pos+msg_len]
         pos += msg_len
-        if len(self.b) != pos - first_pos:
-            if f_raise:
-                raise BlockChainError('Do not match len [{}!={}'.format(len(self.b), pos))
-            else:
-                self.b = self.b[first_pos:pos]
-        self.hash = sha256(sha256(self.b).digest()).digest()
+        return pos
+
+    def _lazy_decode(self):
+        input_len, outputs_len, msg_len = struct_tx_header.unpack_from(self.b)[7:]
+        pos = self._deserialize_body(0, input_len, outputs_len, msg_len)
+        if len(self.b) != pos:
+            raise BlockChainError('Do not match len [{}!={}'.format(len(self.b), pos))
+        self._lazy = False
+
+    @property
+    def inputs(self):
+        if self._lazy:
+            self._lazy_decode()
+        return self._inputs
+
+    @inputs.setter
+    def inputs(self, inputs):
+        if self._lazy:
+            self._lazy_decode()
+        self._inputs = inputs
+
+    @property
+    def outputs(self):
+        if self._lazy:
+            self._lazy_decode()
+        return self._outputs
+
+    @outputs.setter
+    def outputs(self, outputs):
+        if self._lazy:
+            self._lazy_decode()
+        self._outputs = outputs
+
+    @property
+    def message(self):
+        if self._lazy:
+            self._lazy_decode()
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        if self._lazy:
+            self._lazy_decode()
+        self._message = message
 
     def getinfo(self):
         r = OrderedDict()
@@ -73,6 +73,7 @@ class C:  # Constant
     SIZE_TX_LIMIT = 100*1000  # 100kb tx
     CASHE_LIMIT = 100  # Memoryに置く最大Block数、実質Reorg制限
     BATCH_SIZE = 10
+    TX_CASHE_LIMIT = 10000  # DataBaseより読んだTXをMemoryに置く最大数
     MINTCOIN_GAS = int(10 * pow(10, 6))  # 新規Mintcoin発行GasFee
     SIGNATURE_GAS = int(0.01 * pow(10, 6))  # gas per one signature
     # CONTRACT_CREATE_FEE = int(10 * pow(10, 6))  # コントラクト作成GasFee
@@ -54,6 +54,43 @@ def delete_log(txhash, cur):
     """, (txhash,))
 
 
+def read_balance(cur):
+    # confirmed balance of all users, O(users x coins)
+    balance = UserCoins()
+    for user, coin_id, amount in cur.execute("SELECT `user`,`coin_id`,`amount` FROM `balance`"):
+        balance.add_coins(user, coin_id, amount)
+    return balance
+
+
+def update_balance(movements, cur):
+    assert isinstance(movements, UserCoins), 'movements is UserCoin.'
+    for user, coins in movements.items():
+        for coin_id, amount in coins:
+            cur.execute("""
+                INSERT OR IGNORE INTO `balance` (`user`,`coin_id`,`amount`) VALUES (?,?,0)
+            """, (user, coin_id))
+            cur.execute("""
+                UPDATE `balance` SET `amount`=`amount`+? WHERE `user`=? AND `coin_id`=?
+            """, (amount, user, coin_id))
+
+
+def delete_balance(cur):
+    cur.execute("DELETE FROM `balance`")
+    cur.execute("DELETE FROM `meta` WHERE `key`='balance_height'")
+
+
+def read_balance_height(cur):
+    # last block height applied to balance table
+    d = cur.execute("SELECT `value` FROM `meta` WHERE `key`='balance_height'").fetchone()
+    if d is None:
+        return None
+    return d[0]
+
+
+def write_balance_height(height, cur):
+    cur.execute("INSERT OR REPLACE INTO `meta` (`key`,`value`) VALUES ('balance_height',?)", (height,))
+
+
 def read_address2keypair(address, cur):
     d = cur.execute("""
         SELECT `id`,`sk`,`pk` FROM `pool` WHERE `ck`=?
@@ -247,6 +284,7 @@ class MoveLog:
 
 __all__ = [
     "read_txhash2log", "read_log_iter", "insert_log", "delete_log",
+    "read_balance", "update_balance", "delete_balance", "read_balance_height", "write_balance_height",
     "read_address2keypair", "read_address2user", "update_keypair_user", "insert_keypairs",
     "read_account_info", "read_pooled_address_iter", "read_address2account",
     "read_name2user", "read_user2name", "create_account", "create_new_user_keypair",
@@ -0,0 +1,95 @@
+import struct
+import mmap
+import os
+import re
+import logging
+import threading
+
+
+# FILE: blk%05d.dat, append only records of raw block and txs
+# LevelDB value of _block and _tx is pointer [file_no uint4]-[offset uint8]-[length uint4]
+struct_pointer = struct.Struct('>IQI')
+BLOCK_FILE_SIZE = 128 * 1024 * 1024
+re_block_file = re.compile(r'^blk(\d{5})\.dat$')
+
+
+def is_pointer(b):
+    # inline values are always longer than pointer
+    return b is not None and len(b) == struct_pointer.size
+
+
+class BlockFile:
+    """ append only flat files read by mmap """
+
+    def __init__(self, dirs):
+        self.dirs = dirs
+        if not os.path.exists(dirs):
+            os.mkdir(dirs)
+        self.lock = threading.Lock()
+        self.maps = dict()  # {file_no: mmap}
+        numbers = [int(re_block_file.match(name).group(1))
+                   for name in os.listdir(dirs) if re_block_file.match(name)]
+        self.file_no = max(numbers) if numbers else 0
+        self.fp = open(self.path(self.file_no), mode='ab')
+
+    def path(self, file_no):
+        return os.path.join(self.dirs, 'blk%05d.dat' % file_no)
+
+    def append(self, b):
+        # return pointer of b, readable by mmap after return
+        with self.lock:
+            if 0 < self.fp.tell() and BLOCK_FILE_SIZE < self.fp.tell() + len(b):
+                self.fp.flush()
+                os.fsync(self.fp.fileno())
+                self.fp.close()
+                self.file_no += 1
+                self.fp = open(self.path(self.file_no), mode='ab')
+                logging.debug("Next block file {}.".format(self.path(self.file_no)))
+            offset = self.fp.tell()
+            self.fp.write(b)
+            self.fp.flush()
+            return struct_pointer.pack(self.file_no, offset, len(b))
+
+    def sync(self):
+        # call before LevelDB pointers written
+        with self.lock:
+            os.fsync(self.fp.fileno())
+
+    def read(self, pointer):
+        # memoryview slice of mmap, no copy
+        file_no, offset, length = struct_pointer.unpack(pointer)
+        m = self.maps.get(file_no)
+        if m is None or len(m) < offset + length:
+            with self.lock:
+                m = self.maps.get(file_no)
+                if m is None or len(m) < offset + length:
+                    # old map may be used by readers, closed by GC
+                    with open(self.path(file_no), mode='br') as fp:
+                        m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                    self.maps[file_no] = m
+        return memoryview(m)[offset:offset+length]
+
+    def close(self):
+        with self.lock:
+            self.fp.close()
+            for m in self.maps.values():
+                try:
+                    m.close()
+                except BufferError:
+                    pass  # still used
+            self.maps.clear()
+
+    @property
+    def info(self):
+        files = [name for name in os.listdir(self.dirs) if re_block_file.match(name)]
+        return {
+            'files': len(files),
+            'size': sum(os.path.getsize(os.path.join(self.dirs, name)) for name in files),
+            'mapped': len(self.maps)}
+
+
+__all__ = [
+    "struct_pointer",
+    "is_pointer",
+    "BlockFile",
+]
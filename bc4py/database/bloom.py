@@ -0,0 +1,126 @@
+from math import log, ceil
+import struct
+import os
+import zlib
+import logging
+
+
+# FILE: [magic 8s]-[version uint2]-[checkpoint height uint4]-[checkpoint hash 32s]-[filter]-..-[crc32 uint4]
+# FILTER: [name_len uint1]-[name]-[bit_size uint8]-[hash_num uint1]-[capacity uint8]-[count uint8]-[bits]
+BLOOM_MAGIC = b'bc4pyBLM'
+BLOOM_VERSION = 1
+struct_bloom_header = struct.Struct('>8sHI32s')
+struct_bloom_filter = struct.Struct('>QBQQ')
+MIN_CAPACITY = 100000
+
+
+class BloomFilter:
+    """ no false negative key set, keys are already hashed 32bytes """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(MIN_CAPACITY, capacity)
+        self.capacity = capacity
+        self.bit_size = int(ceil(-capacity * log(error_rate) / (log(2) ** 2)))
+        self.hash_num = max(1, int(round(self.bit_size / capacity * log(2))))
+        self.bits = bytearray((self.bit_size + 7) // 8)
+        self.count = 0
+        # metrics
+        self.checks = 0
+        self.negatives = 0
+        self.false_positives = 0
+
+    def _positions(self, k):
+        # double hashing from key bytes
+        h1 = int.from_bytes(k[:8], 'big')
+        h2 = int.from_bytes(k[8:16], 'big') | 1
+        for i in range(self.hash_num):
+            yield (h1 + i * h2) % self.bit_size
+
+    def add(self, k):
+        f_new = False
+        for pos in self._positions(k):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                self.bits[pos >> 3] |= 1 << (pos & 7)
+                f_new = True
+        if f_new:
+            self.count += 1  # about unique keys
+
+    def __contains__(self, k):
+        self.checks += 1
+        for pos in self._positions(k):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                self.negatives += 1
+                return False
+        return True
+
+    def is_full(self):
+        return self.count > self.capacity
+
+    @property
+    def info(self):
+        positives = self.checks - self.negatives
+        return {
+            'count': self.count,
+            'capacity': self.capacity,
+            'size': len(self.bits),
+            'checks': self.checks,
+            'negatives': self.negatives,
+            'false_positives': self.false_positives,
+            'false_positive_rate': round(self.false_positives / positives, 6) if positives else 0.0}
+
+
+def save_blooms(path, blooms, checkpoint):
+    height, blockhash = checkpoint
+    b = struct_bloom_header.pack(BLOOM_MAGIC, BLOOM_VERSION, height, blockhash)
+    for name, bloom in sorted(blooms.items()):
+        b_name = name.encode()
+        b += len(b_name).to_bytes(1, 'big') + b_name
+        b += struct_bloom_filter.pack(bloom.bit_size, bloom.hash_num, bloom.capacity, bloom.count)
+        b += bytes(bloom.bits)
+    b += zlib.crc32(b).to_bytes(4, 'big')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, mode='bw') as fp:
+        fp.write(b)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+    logging.debug("Save bloom filters {}.".format(', '.join(blooms)))
+
+
+def load_blooms(path, checkpoint):
+    # return {name: bloom} or None if not match checkpoint
+    if checkpoint is None or not os.path.exists(path):
+        return None
+    with open(path, mode='br') as fp:
+        b = fp.read()
+    if len(b) < struct_bloom_header.size + 4 or zlib.crc32(b[:-4]) != int.from_bytes(b[-4:], 'big'):
+        logging.warning("Broken bloom filter file.")
+        return None
+    magic, version, height, blockhash = struct_bloom_header.unpack_from(b)
+    if magic != BLOOM_MAGIC or version != BLOOM_VERSION:
+        return None
+    elif (height, blockhash) != tuple(checkpoint):
+        logging.debug("Old bloom filter file, checkpoint not match.")
+        return None
+    blooms = dict()
+    pos = struct_bloom_header.size
+    while pos < len(b) - 4:
+        name_len = b[pos]
+        name = b[pos+1:pos+1+name_len].decode()
+        pos += 1 + name_len
+        bit_size, hash_num, capacity, count = struct_bloom_filter.unpack_from(b, pos)
+        pos += struct_bloom_filter.size
+        bloom = BloomFilter.__new__(BloomFilter)
+        bloom.capacity, bloom.bit_size, bloom.hash_num, bloom.count = capacity, bit_size, hash_num, count
+        bloom.checks = bloom.negatives = bloom.false_positives = 0
+        bloom.bits = bytearray(b[pos:pos+(bit_size + 7) // 8])
+        pos += len(bloom.bits)
+        blooms[name] = bloom
+    return blooms
+
+
+__all__ = [
+    "BloomFilter",
+    "save_blooms",
+    "load_blooms",
+]
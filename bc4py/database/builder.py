@@ -5,6 +5,10 @@ from bc4py.chain.block import Block
 from bc4py.user import CoinObject, UserCoins
 from bc4py.database.account import *
 from bc4py.database.create import closing, create_db
+from bc4py.database.engine import *
+from bc4py.database.journal import Journal
+from bc4py.database.bloom import BloomFilter, save_blooms, load_blooms
+from bc4py.database.blockfile import BlockFile, is_pointer, struct_pointer
 import struct
 import weakref
 import os
@@ -14,22 +18,9 @@ import bjson
 from binascii import hexlify, unhexlify
 import time
 import pickle
+from collections import OrderedDict, deque
 from nem_ed25519.key import is_address
 
-# http://blog.livedoor.jp/wolf200x/archives/53052954.html
-# https://github.com/happynear/py-leveldb-windows
-# https://tangerina.jp/blog/leveldb-1.20-build/
-
-
-try:
-    import plyvel
-    is_plyvel = True
-    create_level_db = plyvel.DB
-except ImportError:
-    import leveldb
-    is_plyvel = False
-    create_level_db = leveldb.LevelDB
-
 
 struct_block = struct.Struct('>II32s80sBI')
 struct_tx = struct.Struct('>4I')
@@ -40,18 +31,89 @@ struct_construct_key = struct.Struct('>40sI')
 struct_construct_value = struct.Struct('>32s32s')
 struct_validator_key = struct.Struct('>40sI')
 struct_validator_value = struct.Struct('>40sb32sb')
+struct_utxo = struct.Struct('>IQIB')
 ITER_ORDER = 'big'
 
 
 ZERO_FILLED_HASH = b'\x00' * 32
 DUMMY_VALIDATOR_ADDRESS = b'\x00' * 40
+META_UTXO_BUILT = b'utxo-built'
+META_CHECKPOINT = b'checkpoint'
+META_PRUNED = b'pruned'
+struct_checkpoint = struct.Struct('>I32s')
 STARTER_NUM = 3
-database_tuple = ("_block", "_tx", "_used_index", "_block_index",
-                  "_address_index", "_coins", "_contract", "_validator")
 # basic config
 config = {
     'full_address_index': True,  # all address index?
+    'unified_db': False,  # create new database as one LevelDB
+    'prune_depth': None,  # keep tx bodies of last N blocks only, None=keep all
+    'bloom_filter': True,  # skip LevelDB read of not found tx and usedindex
+    'block_file': False,  # store raw blocks in blk*.dat, LevelDB has pointers only
+    # LevelDB options, None=default, separated layout uses them for each table
+    'cache_size': None,  # LRU block cache bytes
+    'block_size': None,  # bytes
+    'write_buffer_size': None,  # memtable bytes
 }
+LEVELDB_OPTIONS = ('cache_size', 'block_size', 'write_buffer_size')
+BLOOM_TABLES = ('_tx', '_used_index')
+# only simple tx is pruned, contract and coin txs are read by later txs
+PRUNE_TX_TYPES = (C.TX_POW_REWARD, C.TX_POS_REWARD, C.TX_TRANSFER)
+PRUNE_SWEEP_LIMIT = 1000  # max heights checked by one batch
+
+
+def encode_block(block):
+    b_tx = b''.join(tx.hash for tx in block.txs)
+    if block.work_hash is None:
+        block.update_pow()
+    b = struct_block.pack(block.height, block.time, block.work_hash, block.b, block.flag, len(b_tx))
+    return b + b_tx
+
+
+def decode_block(b, blockhash=None):
+    # blockhash and txhash are keys of database, skip hashing
+    height, _time, work, b_block, flag, tx_len = struct_block.unpack_from(b)
+    idx = struct_block.size
+    # block file record has tx values after
+    assert len(b) >= idx+tx_len, 'Not correct size. [{}>={}]'.format(len(b), idx+tx_len)
+    block = Block(binary=b_block, blockhash=blockhash)
+    block.height = height
+    block.work_hash = work
+    block.flag = flag
+    txhashes = [b[idx+32*i:idx+32*i+32] for i in range(tx_len//32)]
+    return block, txhashes
+
+
+def decode_block_record(b, blockhash=None):
+    # block and txs, txs is None if not block file record
+    block, txhashes = decode_block(b, blockhash)
+    pos = struct_block.size + 32 * len(txhashes)
+    if pos == len(b):
+        return block, txhashes, None
+    txs = list()
+    for txhash in txhashes:
+        height, _time, bin_len, sign_len = struct_tx.unpack_from(b, pos)
+        size = 16 + bin_len + sign_len
+        txs.append(decode_tx(b[pos:pos+size], txhash))
+        pos += size
+    return block, txhashes, txs
+
+
+def encode_tx(tx):
+    b_sign = signature2bin(tx.signature)
+    b = struct_tx.pack(tx.height, tx.time, len(tx.b), len(b_sign))
+    return b + tx.b + b_sign
+
+
+def decode_tx(b, txhash=None):
+    height, _time, bin_len, sign_len = struct_tx.unpack_from(b)
+    b_tx = bytes(b[16:16+bin_len])
+    b_sign = bytes(b[16+bin_len:16+bin_len+sign_len])
+    assert len(b) == 16+bin_len+sign_len, 'Wrong len [{}={}]'\
+        .format(len(b), 16+bin_len+sign_len)
+    tx = TX(binary=b_tx, txhash=txhash)
+    tx.height = height
+    tx.signature = bin2signature(b_sign)
+    return tx
 
 
 class DataBase:
@@ -60,6 +122,7 @@ class DataBase:
         self.sync = True
         self.timeout = None
         config.update(kwargs)  # extra settings
+        assert config['prune_depth'] is None or config['prune_depth'] > 0, 'prune_depth is positive or None.'
         self.event = threading.Event()
         self.event.set()
         # already used => LevelDBError
@@ -69,26 +132,43 @@ class DataBase:
             logging.debug('No db dir, create database first.')
             os.mkdir(dirs)
             f_create = True
-        self._block = create_level_db(os.path.join(dirs, 'block'), create_if_missing=f_create)
-        self._tx = create_level_db(os.path.join(dirs, 'tx'), create_if_missing=f_create)
-        self._used_index = create_level_db(os.path.join(dirs, 'used-index'), create_if_missing=f_create)
-        self._block_index = create_level_db(os.path.join(dirs, 'block-index'), create_if_missing=f_create)
-        self._address_index = create_level_db(os.path.join(dirs, 'address-index'), create_if_missing=f_create)
-        self._coins = create_level_db(os.path.join(dirs, 'coins'), create_if_missing=f_create)
-        self._contract = create_level_db(os.path.join(dirs, 'contract'), create_if_missing=f_create)
-        self._validator = create_level_db(os.path.join(dirs, 'validator'), create_if_missing=f_create)
+        self._engine = open_engine(dirs, f_create, unified=config['unified_db'],
+                                   **{k: config[k] for k in LEVELDB_OPTIONS})
         self.batch = None
         self.batch_thread = None
-        logging.debug(':create database connect, plyvel={} {}'.format(is_plyvel, dirs))
+        # write-behind, committed batches wait in pending until writer thread flush
+        self.write_behind = False
+        self.max_pending = 2
+        self.pending = deque()
+        self.pending_cond = threading.Condition()
+        self.writer_thread = None
+        self.writer_closing = False
+        self.write_error = None
+        # {table: BloomFilter} enabled after load_bloom()
+        self.blooms = dict()
+        # once created, keep using block file
+        block_dirs = os.path.join(dirs, 'blocks')
+        if config['block_file'] or os.path.exists(block_dirs):
+            self.block_file = BlockFile(block_dirs)
+        else:
+            self.block_file = None
+        logging.debug(':create database connect, plyvel={} unified={} {}'
+                      .format(is_plyvel, self._engine.unified, dirs))
 
     def close(self):
-        if is_plyvel:
-            for name in database_tuple:
-                getattr(self, name).close()
-        # else:  # TODO: how to close?
-        #    for name in database_tuple:
-        #        print(getattr(self, name).GetStats())
-        #        getattr(self, name).__dell__()
+        try:
+            self.flush()
+        except BlockBuilderError as e:
+            logging.error(e)
+        with self.pending_cond:
+            self.writer_closing = True
+            self.pending_cond.notify_all()
+        if self.writer_thread:
+            self.writer_thread.join()
+        self.save_bloom()
+        self._engine.close()
+        if self.block_file:
+            self.block_file.close()
         logging.info("Close database connection.")
 
     def batch_create(self):
@@ -98,30 +178,35 @@ class DataBase:
         self.event.clear()
         self.batch = dict()
         for name in database_tuple:
-            self.batch[name] = dict()
+            self.batch[name] = BatchTable()
         self.batch_thread = threading.current_thread()
         logging.debug(":Create database batch.")
 
-    def batch_commit(self):
+    def batch_commit(self, on_written=None):
+        # on_written is called after batch is written to disk
         assert self.batch, 'Not created batch.'
-        if is_plyvel:
-            for name, memory in self.batch.items():
-                batch = getattr(self, name).write_batch(sync=self.sync)
-                for k, v in memory.items():
-                    batch.put(k, v)
-                batch.write()
+        # add keys before written, readers check batch first
+        for name, bloom in self.blooms.items():
+            for k, v in self.batch[name].items():
+                if v is not None:
+                    bloom.add(k)
+        # raw blocks are on disk before pointers
+        if self.block_file and self.sync:
+            self.block_file.sync()
+        if self.write_behind:
+            self._put_pending(self.batch, on_written)
         else:
-            for name, memory in self.batch.items():
-                new_data = leveldb.WriteBatch()
-                for k, v in memory.items():
-                    new_data.Put(k, v)
-                getattr(self, name).Write(new_data, sync=self.sync)
+            self._engine.write(self.batch, sync=self.sync)
+            if on_written:
+                on_written()
         self.batch = None
         self.batch_thread = None
         self.event.set()
         logging.debug("Commit database.")
 
     def batch_rollback(self):
+        # cashe may hold tx read from rollbacked batch
+        tx_builder.cashe.clear()
         self.batch = None
         self.batch_thread = None
         self.event.set()
@@ -130,87 +215,285 @@ class DataBase:
     def is_batch_thread(self):
         return self.batch and self.batch_thread is threading.current_thread()
 
+    def _put_pending(self, batch, on_written):
+        with self.pending_cond:
+            while len(self.pending) >= self.max_pending and self.write_error is None:
+                self.pending_cond.wait()
+            if self.write_error is not None:
+                raise BlockBuilderError('Database writer is stopped by "{}".'.format(self.write_error))
+            self.pending.append((batch, on_written))
+            if self.writer_thread is None:
+                self.writer_thread = threading.Thread(target=self._writer, name='DBWriter', daemon=True)
+                self.writer_thread.start()
+            self.pending_cond.notify_all()
+
+    def _writer(self):
+        while True:
+            with self.pending_cond:
+                while len(self.pending) == 0:
+                    if self.writer_closing:
+                        return
+                    self.pending_cond.wait()
+                batch, on_written = self.pending[0]
+            try:
+                self._engine.write(batch, sync=self.sync)
+            except BaseException as e:
+                logging.critical("Failed write database batch. '{}'".format(e), exc_info=True)
+                with self.pending_cond:
+                    self.write_error = e
+                    self.pending_cond.notify_all()
+                return
+            # remove after write, readers see it on pending until here
+            with self.pending_cond:
+                self.pending.popleft()
+                self.pending_cond.notify_all()
+            if on_written:
+                try:
+                    on_written()
+                except Exception as e:
+                    logging.error("Failed after written callback. '{}'".format(e), exc_info=True)
+
+    def flush(self):
+        # wait for all pending batches written
+        with self.pending_cond:
+            while len(self.pending) > 0 and self.write_error is None:
+                self.pending_cond.wait()
+            if self.write_error is not None:
+                raise BlockBuilderError('Database writer is stopped by "{}".'.format(self.write_error))
+
+    def load_bloom(self):
+        if not config['bloom_filter']:
+            return
+        path = os.path.join(self.dirs, 'bloom.dat')
+        blooms = load_blooms(path, self.read_checkpoint())
+        if blooms is None or set(blooms) != set(BLOOM_TABLES):
+            blooms = self.rebuild_bloom()
+        self.blooms = blooms
+
+    def rebuild_bloom(self):
+        t = time.time()
+        blooms = dict()
+        for name in BLOOM_TABLES:
+            count = sum(1 for dummy in self._engine.keys(name))
+            bloom = BloomFilter(capacity=count * 2)
+            for k in self._engine.keys(name):
+                bloom.add(k)
+            blooms[name] = bloom
+            logging.info("Rebuild bloom filter {} {}keys.".format(name, count))
+        logging.info("Rebuilt bloom filters {}Sec.".format(round(time.time()-t, 1)))
+        return blooms
+
+    def save_bloom(self):
+        # saved with checkpoint, full filter is rebuilt larger next time
+        path = os.path.join(self.dirs, 'bloom.dat')
+        checkpoint = self.read_checkpoint()
+        if len(self.blooms) == 0 or checkpoint is None:
+            return
+        elif any(bloom.is_full() for bloom in self.blooms.values()):
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        save_blooms(path, self.blooms, checkpoint)
+
+    def stats(self, count_keys=False):
+        # approximate sizes, count_keys=True scans all keys
+        with self.pending_cond:
+            pending_batches = [batch for batch, dummy in self.pending]
+        tables = dict()
+        for name in database_tuple:
+            if count_keys:
+                keys = sum(1 for dummy in self._engine.keys(name))
+            elif name in self.blooms:
+                keys = self.blooms[name].count
+            else:
+                keys = None
+            tables[name] = {
+                'size': self._engine.table_size(name),
+                'keys': keys,
+                'pending_keys': sum(len(batch[name]) for batch in pending_batches)}
+        data = {
+            'unified': self._engine.unified,
+            'plyvel': is_plyvel,
+            'directory': self.dirs,
+            'options': {k: config[k] for k in LEVELDB_OPTIONS},
+            'tables': tables,
+            'write_behind': self.write_behind,
+            'pending_batches': len(pending_batches),
+            'pending_keys': sum(len(memory) for batch in pending_batches for memory in batch.values()),
+            'block_file': self.block_file.info if self.block_file else None}
+        data.update(self._engine.info())
+        return data
+
+    def compact(self, name=None):
+        # compact one table or all, slow and blocking
+        names = database_tuple if name is None else (name,)
+        for name in names:
+            if name not in database_tuple:
+                raise BlockBuilderError('Unknown table {}.'.format(name))
+        t = time.time()
+        for name in names:
+            self._engine.compact(name)
+            logging.info("Compact table {}.".format(name))
+        logging.info("Finish compaction {}Sec.".format(round(time.time()-t, 1)))
+
+    @property
+    def bloom_info(self):
+        return {name: bloom.info for name, bloom in self.blooms.items()}
+
+    def snapshot(self):
+        # copy pending first, writer thread may move it to disk after
+        with self.pending_cond:
+            pending_batches = [batch for batch, dummy in self.pending]
+        return DataBaseSnapshot(self, pending_batches, self._engine.snapshot())
+
+    def _layers(self, name):
+        # not written tables, old to new
+        layers = [batch[name] for batch, dummy in list(self.pending)]
+        if self.is_batch_thread():
+            layers.append(self.batch[name])
+        return layers
+
+    def _resolve(self, name, b):
+        # pointer => raw block record or tx value on block file
+        if self.block_file and name in ('_block', '_tx') and is_pointer(b):
+            b = self.block_file.read(b)
+            return bytes(b) if name == '_block' else b
+        return b
+
+    def _get(self, name, k):
+        for memory in reversed(self._layers(name)):
+            if k in memory:
+                return self._resolve(name, memory[k])
+        bloom = self.blooms.get(name)
+        if bloom is None:
+            return self._resolve(name, self._engine.get(name, k))
+        elif k not in bloom:
+            return None
+        b = self._engine.get(name, k)
+        if b is None:
+            bloom.false_positives += 1
+        return self._resolve(name, b)
+
+    def _iter(self, name, start=None, stop=None):
+        level_iter = self._engine.iterator(name, start=start, stop=stop)
+        for memory in self._layers(name):
+            level_iter = merge_iter(level_iter, memory.range_items(start, stop))
+        return level_iter
+
+    def _last_index(self, name, prefix):
+        # KEY [prefix]-[index uint4], seek last key instead of full scan
+        start, stop = prefix + b'\x00'*4, prefix + b'\xff'*4
+        last = None
+        for k, v in self._engine.iterator(name, start=start, stop=stop, reverse=True):
+            last = (k, v)
+            break
+        for memory in self._layers(name):
+            item = memory.last_item(start, stop)
+            if item and (last is None or item[0] >= last[0]):
+                last = item
+        if last is None:
+            return -1, None
+        return int.from_bytes(last[0][-4:], ITER_ORDER), last[1]
+
+    def _next_index(self, name, prefix):
+        index, dummy = self._last_index(name=name, prefix=prefix)
+        return index + 1
+
     def read_block(self, blockhash):
-        if self.is_batch_thread() and blockhash in self.batch['_block']:
-            b = self.batch['_block'][blockhash]
-        elif is_plyvel:
-            b = self._block.get(blockhash, default=None)
-        else:
-            b = self._block.Get(blockhash, default=None)
+        b = self._get('_block', blockhash)
         if b is None:
             return None
-        b = bytes(b)
-        height, _time, work, b_block, flag, tx_len = struct_block.unpack_from(b)
-        idx = struct_block.size
-        assert len(b) == idx+tx_len, 'Not correct size. [{}={}]'.format(len(b), idx+tx_len)
-        block = Block(binary=b_block)
-        block.height = height
-        block.work_hash = work
-        block.flag = flag
-        # block.txs = [self.read_tx(b[idx+32*i:idx+32*i+32]) for i in range(tx_len//32)]
-        block.txs = [tx_builder.get_tx(b[idx+32*i:idx+32*i+32]) for i in range(tx_len//32)]
+        block, txhashes, txs = decode_block_record(b, blockhash)
+        if txs is not None:
+            # one slice of block file
+            block.txs = txs
+            return block
+        # block.txs = [self.read_tx(txhash) for txhash in txhashes]
+        block.txs = [tx_builder.get_tx(txhash) for txhash in txhashes]
+        if None in block.txs:
+            logging.debug("Block {} is pruned.".format(block))
+            return None
         return block
 
+    def _read_many(self, name, keys):
+        # {key: value} of found keys, batch first
+        result = dict()
+        for memory in reversed(self._layers(name)):
+            for k in keys:
+                if k not in result and k in memory:
+                    result[k] = memory[k]
+        keys = set(keys) - set(result)
+        bloom = self.blooms.get(name)
+        if bloom is not None:
+            keys = {k for k in keys if k in bloom}
+        for k, v in self._engine.get_many(name, keys):
+            result[k] = v
+            if v is None and bloom is not None:
+                bloom.false_positives += 1
+        return {k: self._resolve(name, v) for k, v in result.items() if v is not None}
+
+    def read_txs_many(self, txhashes):
+        # {txhash: tx} with one sorted pass
+        result = dict()
+        for txhash, b in self._read_many('_tx', txhashes).items():
+            tx = decode_tx(b, txhash)
+            tx.f_on_memory = False
+            result[txhash] = tx
+        return result
+
+    def read_blocks_range(self, start_height, stop_height=None, chunk_size=100):
+        # yield height, block from start_height to stop_height(not include)
+        index = list()
+        for height, blockhash in self.read_block_hash_iter(start_height=start_height):
+            if stop_height is not None and height >= stop_height:
+                break
+            index.append((height, blockhash))
+            if len(index) >= chunk_size:
+                yield from self._read_blocks_chunk(index)
+                index = list()
+        if len(index) > 0:
+            yield from self._read_blocks_chunk(index)
+
+    def _read_blocks_chunk(self, index):
+        b_blocks = self._read_many('_block', [blockhash for height, blockhash in index])
+        blocks = list()
+        txhashes = list()
+        for height, blockhash in index:
+            block, block_txhashes, block_txs = decode_block_record(b_blocks[blockhash], blockhash)
+            if block_txs is not None:
+                block.txs = block_txs
+                blocks.append((height, block, None))
+                continue
+            blocks.append((height, block, block_txhashes))
+            txhashes.extend(block_txhashes)
+        txs = self.read_txs_many(txhashes)
+        for height, block, block_txhashes in blocks:
+            if block_txhashes is None:
+                yield height, block  # from block file
+                continue
+            elif not all(txhash in txs for txhash in block_txhashes):
+                raise BlockBuilderError('Block {} is pruned.'.format(block))
+            block.txs = [txs[txhash] for txhash in block_txhashes]
+            yield height, block
+
     def read_block_hash(self, height):
         b_height = height.to_bytes(4, ITER_ORDER)
-        if self.is_batch_thread() and b_height in self.batch['_block_index']:
-            return self.batch['_block_index'][b_height]
-        elif is_plyvel:
-            b = self._block_index.get(b_height, default=None)
-        else:
-            b = self._block_index.Get(b_height, default=None)
-        if b is None:
-            return None
-        else:
-            return bytes(b)
+        return self._get('_block_index', b_height)
 
     def read_block_hash_iter(self, start_height=0):
-        f_batch = self.is_batch_thread()
-        batch_copy = self.batch['_block_index'].copy() if self.batch else dict()
         start = start_height.to_bytes(4, ITER_ORDER)
-        if is_plyvel:
-            block_iter = self._block_index.iterator(start=start)
-        else:
-            block_iter = self._block_index.RangeIter(key_from=start)
-        for b_height, blockhash in block_iter:
+        for b_height, blockhash in self._iter('_block_index', start=start):
             # height, blockhash
-            b_height = bytes(b_height)
-            blockhash = bytes(blockhash)
-            if f_batch and b_height in batch_copy:
-                blockhash = batch_copy[b_height]
-                del batch_copy[b_height]
             yield int.from_bytes(b_height, ITER_ORDER), blockhash
-        if f_batch:
-            for b_height, blockhash in sorted(batch_copy.items(), key=lambda x: x[0]):
-                yield int.from_bytes(b_height, ITER_ORDER), blockhash
 
     def read_tx(self, txhash):
-        if self.is_batch_thread() and txhash in self.batch['_tx']:
-            b = self.batch['_tx'][txhash]
-        elif is_plyvel:
-            b = self._tx.get(txhash, default=None)
-        else:
-            b = self._tx.Get(txhash, default=None)
+        b = self._get('_tx', txhash)
         if b is None:
             return None
-        b = bytes(b)
-        height, _time, bin_len, sign_len = struct_tx.unpack_from(b)
-        b_tx = b[16:16+bin_len]
-        b_sign = b[16+bin_len:16+bin_len+sign_len]
-        assert len(b) == 16+bin_len+sign_len, 'Wrong len [{}={}]'\
-            .format(len(b), 16+bin_len+sign_len)
-        tx = TX(binary=b_tx)
-        tx.height = height
-        tx.signature = bin2signature(b_sign)
-        return tx
+        return decode_tx(b, txhash)
 
     def read_usedindex(self, txhash):
-        if self.is_batch_thread() and txhash in self.batch['_used_index']:
-            b = self.batch['_used_index'][txhash]
-        elif is_plyvel:
-            b = self._used_index.get(txhash, default=None)
-        else:
-            b = self._used_index.Get(txhash, default=None)
+        b = self._get('_used_index', txhash)
         if b is None:
             return set()
         else:
@@ -218,152 +501,125 @@ class DataBase:
 
     def read_address_idx(self, address, txhash, index):
         k = address.encode() + txhash + index.to_bytes(1, ITER_ORDER)
-        if self.is_batch_thread() and k in self.batch['_address_index']:
-            b = self.batch['_address_index'][k]
-        elif is_plyvel:
-            b = self._address_index.get(k, default=None)
-        else:
-            b = self._address_index.Get(k, default=None)
+        b = self._get('_address_index', k)
         if b is None:
             return None
-        b = bytes(b)
         # coin_id, amount, f_used
         return struct_address_idx.unpack(b)
 
+    def read_utxo_iter(self, address):
+        # KEY [address 40s]-[txhash 32s]-[index uint1]
+        # VALUE [coin_id uint4]-[amount uint8]-[height uint4]-[type uint1]
+        b_address = address.encode()
+        start = b_address + b'\x00'*33
+        stop = b_address + b'\xff'*33
+        for k, v in self._iter('_utxo', start=start, stop=stop):
+            dummy, txhash, index = struct_address.unpack(k)
+            yield (txhash, index) + struct_utxo.unpack(v)
+
+    def read_meta(self, k):
+        return self._get('_meta', k)
+
+    def read_checkpoint(self):
+        # verified height and blockhash, written with batch
+        b = self.read_meta(META_CHECKPOINT)
+        if b is None:
+            return None
+        return struct_checkpoint.unpack(b)
+
+    def read_pruned_height(self):
+        # all blocks lower or equal than this height are pruned
+        b = self.read_meta(META_PRUNED)
+        if b is None:
+            return None
+        return int.from_bytes(b, ITER_ORDER)
+
     def read_address_idx_iter(self, address):
-        f_batch = self.is_batch_thread()
-        batch_copy = self.batch['_address_index'].copy() if self.batch else dict()
         b_address = address.encode()
         start = b_address+b'\x00'*(32+1)
         stop = b_address+b'\xff'*(32+1)
-        if is_plyvel:
-            address_iter = self._address_index.iterator(start=start, stop=stop)
-        else:
-            address_iter = self._address_index.RangeIter(key_from=start, key_to=stop)
-        for k, v in address_iter:
-            k, v = bytes(k), bytes(v)
+        for k, v in self._iter('_address_index', start=start, stop=stop):
             # address, txhash, index, coin_id, amount, f_used
-            if f_batch and k in batch_copy:
-                v = batch_copy[k]
-                del batch_copy[k]
             yield struct_address.unpack(k) + struct_address_idx.unpack(v)
-        if f_batch:
-            for k, v in sorted(batch_copy.items(), key=lambda x: x[0]):
-                if k.startswith(b_address):
-                    yield struct_address.unpack(k) + struct_address_idx.unpack(v)
 
     def read_coins_iter(self, coin_id):
-        f_batch = self.is_batch_thread()
-        batch_copy = self.batch['_coins'].copy() if self.batch else dict()
         b_coin_id = coin_id.to_bytes(4, ITER_ORDER)
         start = b_coin_id + b'\x00'*4
         stop = b_coin_id + b'\xff'*4
-        if is_plyvel:
-            coins_iter = self._coins.iterator(start=start, stop=stop)
-        else:
-            coins_iter = self._coins.RangeIter(key_from=start, key_to=stop)
-        for k, v in coins_iter:
-            k, v = bytes(k), bytes(v)
+        for k, v in self._iter('_coins', start=start, stop=stop):
             # coin_id, index, txhash
-            if f_batch and k in batch_copy:
-                v = batch_copy[k]
-                del batch_copy[k]
             dummy, index = struct_coins.unpack(k)
             txhash, (params, setting) = v[:32], bjson.loads(v[32:])
             yield index, txhash, params, setting
-        if f_batch:
-            for k, v in sorted(batch_copy.items(), key=lambda x: x[0]):
-                if k.startswith(b_coin_id):
-                    dummy, index = struct_coins.unpack(k)
-                    txhash, (params, setting) = v[:32], bjson.loads(v[32:])
-                    yield index, txhash, params, setting
 
     def read_contract_iter(self, c_address):
-        f_batch = self.is_batch_thread()
-        batch_copy = self.batch['_contract'].copy() if self.batch else dict()
         b_c_address = c_address.encode()
         start = b_c_address + b'\x00'*4
         stop = b_c_address + b'\xff'*4
-        if is_plyvel:
-            contract_iter = self._contract.iterator(start=start, stop=stop)
-        else:
-            contract_iter = self._contract.RangeIter(key_from=start, key_to=stop)
-        for k, v in contract_iter:
-            k, v = bytes(k), bytes(v)
+        for k, v in self._iter('_contract', start=start, stop=stop):
             # KEY: [c_address 40s]-[index uint4]
             # VALUE: [start_hash 32s]-[finish_hash 32s]-[len uint4]-[bjson(c_method, c_args, c_storage)]
             # c_address, index, start_hash, finish_hash, message
-            if f_batch and k in batch_copy:
-                v = batch_copy[k]
-                del batch_copy[k]
             dummy, index = struct_construct_key.unpack(k)
             start_hash, finish_hash, raw_message = v[0:32], v[32:64], v[64:]
             message = bjson.loads(raw_message)
             yield index, start_hash, finish_hash, message
-        if f_batch:
-            for k, v in sorted(batch_copy.items(), key=lambda x: x[0]):
-                if k.startswith(b_c_address):
-                    dummy, index = struct_construct_key.unpack(k)
-                    start_hash, finish_hash, raw_message = v[0:32], v[32:64], v[64:]
-                    message = bjson.loads(raw_message)
-                    yield index, start_hash, finish_hash, message
+
+    def read_contract_last(self, c_address):
+        index, v = self._last_index(name='_contract', prefix=c_address.encode())
+        if v is None:
+            return None
+        start_hash, finish_hash, raw_message = v[0:32], v[32:64], v[64:]
+        return index, start_hash, finish_hash, bjson.loads(raw_message)
 
     def read_validator_iter(self, c_address):
-        f_batch = self.is_batch_thread()
-        batch_copy = self.batch['_validator'].copy() if self.batch else dict()
         b_c_address = c_address.encode()
         start = b_c_address + b'\x00'*4
         stop = b_c_address + b'\xff'*4
-        # from database
-        if is_plyvel:
-            validator_iter = self._validator.iterator(start=start, stop=stop)
-        else:
-            validator_iter = self._validator.RangeIter(key_from=start, key_to=stop)
-        for k, v in validator_iter:
-            k, v = bytes(k), bytes(v)
+        for k, v in self._iter('_validator', start=start, stop=stop):
             # KEY [c_address 40s]-[index unit4]
             # VALUE [new_address 40s]-[flag int1]-[txhash 32s]-[sig_diff int1]
-            if f_batch and k in batch_copy:
-                v = batch_copy[k]
-                del batch_copy[k]
             dummy, index = struct_validator_key.unpack(k)
             new_address, flag, txhash, sig_diff = struct_validator_value.unpack(v)
             if new_address == DUMMY_VALIDATOR_ADDRESS:
                 yield index, None, flag, txhash, sig_diff
             else:
                 yield index, new_address.decode(), flag, txhash, sig_diff
-        # from memory
-        if f_batch:
-            for k, v in sorted(batch_copy.items(), key=lambda x: x[0]):
-                if k.startswith(b_c_address):
-                    dummy, index = struct_validator_key.unpack(k)
-                    new_address, flag, txhash, sig_diff = struct_validator_value.unpack(v)
-                    if new_address == DUMMY_VALIDATOR_ADDRESS:
-                        yield index, None, flag, txhash, sig_diff
-                    else:
-                        yield index, new_address.decode(), flag, txhash, sig_diff
+
+    def read_validator_last(self, c_address):
+        index, v = self._last_index(name='_validator', prefix=c_address.encode())
+        if v is None:
+            return None
+        new_address, flag, txhash, sig_diff = struct_validator_value.unpack(v)
+        if new_address == DUMMY_VALIDATOR_ADDRESS:
+            return index, None, flag, txhash, sig_diff
+        else:
+            return index, new_address.decode(), flag, txhash, sig_diff
 
     def write_block(self, block):
         assert self.is_batch_thread(), 'Not created batch.'
-        b_tx = b''.join(tx.hash for tx in block.txs)
-        tx_len = len(b_tx)
-        if block.work_hash is None:
-            block.update_pow()
-        b = struct_block.pack(block.height, block.time, block.work_hash, block.b, block.flag, tx_len)
-        b += b_tx
-        self.batch['_block'][block.hash] = b
+        b = encode_block(block)
+        if self.block_file:
+            # [block value]-[tx value]-[tx value]-.. contiguously
+            b_txs = [encode_tx(tx) for tx in block.txs]
+            pointer = self.block_file.append(b + b''.join(b_txs))
+            self.batch['_block'][block.hash] = pointer
+            file_no, offset, length = struct_pointer.unpack(pointer)
+            offset += len(b)
+            for tx, b_tx in zip(block.txs, b_txs):
+                self.batch['_tx'][tx.hash] = struct_pointer.pack(file_no, offset, len(b_tx))
+                offset += len(b_tx)
+        else:
+            self.batch['_block'][block.hash] = b
         b_height = block.height.to_bytes(4, ITER_ORDER)
         self.batch['_block_index'][b_height] = block.hash
         logging.debug("Insert new block {}".format(block))
 
     def write_tx(self, tx):
         assert self.is_batch_thread(), 'Not created batch.'
-        bin_len = len(tx.b)
-        b_sign = signature2bin(tx.signature)
-        sign_len = len(b_sign)
-        b = struct_tx.pack(tx.height, tx.time, bin_len, sign_len)
-        b += tx.b + b_sign
-        self.batch['_tx'][tx.hash] = b
+        if is_pointer(self.batch['_tx'].get(tx.hash)):
+            return  # written with block to block file
+        self.batch['_tx'][tx.hash] = encode_tx(tx)
         logging.debug("Insert new tx {}".format(tx))
 
     def write_usedindex(self, txhash, usedindex):
@@ -378,11 +634,66 @@ class DataBase:
         self.batch['_address_index'][k] = v
         logging.debug("Insert new address idx {}".format(address))
 
+    def write_utxo(self, address, txhash, index, coin_id, amount, height, tx_type):
+        assert self.is_batch_thread(), 'Not created batch.'
+        k = address.encode() + txhash + index.to_bytes(1, ITER_ORDER)
+        self.batch['_utxo'][k] = struct_utxo.pack(coin_id, amount, height, tx_type)
+
+    def remove_utxo(self, address, txhash, index):
+        assert self.is_batch_thread(), 'Not created batch.'
+        k = address.encode() + txhash + index.to_bytes(1, ITER_ORDER)
+        self.batch['_utxo'][k] = None
+
+    def write_meta(self, k, v):
+        assert self.is_batch_thread(), 'Not created batch.'
+        self.batch['_meta'][k] = v
+
+    def write_checkpoint(self, height, blockhash):
+        self.write_meta(META_CHECKPOINT, struct_checkpoint.pack(height, blockhash))
+
+    def write_pruned_height(self, height):
+        self.write_meta(META_PRUNED, height.to_bytes(4, ITER_ORDER))
+
+    def remove_tx(self, tx):
+        # body, usedindex and address index of all spent tx
+        assert self.is_batch_thread(), 'Not created batch.'
+        self.batch['_tx'][tx.hash] = None
+        self.batch['_used_index'][tx.hash] = None
+        for index, (address, coin_id, amount) in enumerate(tx.outputs):
+            k = address.encode() + tx.hash + index.to_bytes(1, ITER_ORDER)
+            self.batch['_address_index'][k] = None
+        tx_builder.cashe.remove(tx.hash)
+        logging.debug("Remove pruned tx {}".format(tx))
+
+    def rebuild_utxo(self, chunk_size=10000):
+        # unspent address index => utxo table, only once for old database
+        self.batch_create()
+        count = 0
+        input_tx = None
+        try:
+            for k, v in self._engine.iterator('_address_index'):
+                address, txhash, index = struct_address.unpack(k)
+                coin_id, amount, f_used = struct_address_idx.unpack(v)
+                if f_used:
+                    continue
+                if input_tx is None or input_tx.hash != txhash:
+                    input_tx = self.read_tx(txhash)
+                self.write_utxo(address.decode(), txhash, index, coin_id, amount, input_tx.height, input_tx.type)
+                count += 1
+                if count % chunk_size == 0:
+                    self.batch_commit()
+                    self.batch_create()
+                    logging.info("Rebuilding utxo table... {}".format(count))
+            self.write_meta(META_UTXO_BUILT, b'\x01')
+            self.batch_commit()
+        except BaseException:
+            self.batch_rollback()
+            raise
+        logging.info("Rebuilt utxo table, {} unspents.".format(count))
+
     def write_coins(self, coin_id, txhash, params, setting):
         assert self.is_batch_thread(), 'Not created batch.'
-        index = -1
-        for index, *dummy in self.read_coins_iter(coin_id=coin_id): pass
-        index += 1
+        index = self._next_index(name='_coins', prefix=coin_id.to_bytes(4, ITER_ORDER))
         k = coin_id.to_bytes(4, ITER_ORDER) + index.to_bytes(4, ITER_ORDER)
         v = txhash + bjson.dumps((params, setting), compress=False)
         self.batch['_coins'][k] = v
@@ -391,9 +702,7 @@ class DataBase:
     def write_contract(self, c_address, start_hash, finish_hash, message):
         assert self.is_batch_thread(), 'Not created batch.'
         assert len(message) == 3
-        index = -1
-        for index, *dummy in self.read_contract_iter(c_address=c_address): pass
-        index += 1
+        index = self._next_index(name='_contract', prefix=c_address.encode())
         k = c_address.encode() + index.to_bytes(4, ITER_ORDER)
         v = start_hash + finish_hash + bjson.dumps(message, compress=False)
         self.batch['_contract'][k] = v
@@ -401,9 +710,7 @@ class DataBase:
 
     def write_validator(self, c_address, new_address, flag, txhash, sign_diff):
         assert self.is_batch_thread(), 'Not created batch.'
-        index = -1
-        for index, *dummy in self.read_validator_iter(c_address=c_address): pass
-        index += 1
+        index = self._next_index(name='_validator', prefix=c_address.encode())
         if new_address is None:
             new_address = DUMMY_VALIDATOR_ADDRESS
         else:
@@ -414,6 +721,47 @@ class DataBase:
         logging.debug("Insert new validator {} {}".format(c_address, index))
 
 
+class DataBaseSnapshot(DataBase):
+    """ read only view of database at one point """
+
+    def __init__(self, db, pending_batches, engine):
+        self.dirs = db.dirs
+        self._engine = engine
+        self.batch = None
+        self.batch_thread = None
+        self.pending_batches = pending_batches
+        self.blooms = db.blooms  # only grows, no false negative on old view
+        self.block_file = db.block_file  # append only
+
+    def close(self):
+        self._engine.close()
+
+    def snapshot(self):
+        raise BlockBuilderError('Already snapshot.')
+
+    def _layers(self, name):
+        return [batch[name] for batch in self.pending_batches]
+
+    def is_batch_thread(self):
+        return False
+
+    def read_block(self, blockhash):
+        # txs from same view, not from live tx_builder
+        b = self._get('_block', blockhash)
+        if b is None:
+            return None
+        block, txhashes, txs = decode_block_record(b, blockhash)
+        if txs is not None:
+            block.txs = txs
+            return block
+        txs = self.read_txs_many(txhashes)
+        if not all(txhash in txs for txhash in txhashes):
+            logging.debug("Block {} is pruned.".format(block))
+            return None
+        block.txs = [txs[txhash] for txhash in txhashes]
+        return block
+
+
 class ChainBuilder:
     def __init__(self, cashe_limit=C.CASHE_LIMIT, batch_size=C.BATCH_SIZE):
         assert cashe_limit > batch_size, 'cashe_limit > batch_size.'
@@ -426,6 +774,19 @@ class ChainBuilder:
         self.best_chain = None
         self.root_block = None
         self.best_block = None
+        # {height: block} and {blockhash,..} of self.best_chain
+        self.best_chain_height = dict()
+        self.best_chain_hashes = set()
+        # {txhash: {txindex: {blockhash: spender_txhash}}} of self.chain
+        self.spent_index = dict()
+        # {blockhash: score sum from root_block} of blocks connected to root_block
+        self.chain_score = dict()
+        # {previous_hash: [block,..]} waiting for previous block
+        self.orphan_children = dict()
+        self.best_score = 0.0
+        # memory chain and database are changed together under lock
+        self.lock = threading.RLock()
+        self.journal = None
         self.db = None
         try:
             self.db = DataBase(os.path.join(V.DB_HOME_DIR, 'db'))
@@ -436,22 +797,28 @@ class ChainBuilder:
 
     def close(self):
         self.db.batch_create()
-        self.save_starter()
         self.db.close()
+        if self.journal:
+            self.journal.close()
 
     def set_database_path(self, **kwargs):
         try:
             self.db = DataBase(os.path.join(V.DB_HOME_DIR, 'db'), **kwargs)
             logging.info("Connect database.")
-        except leveldb.LevelDBError:
+        except LevelDBError:
             logging.warning("Already connect database.")
         except BaseException as e:
             logging.debug("Failed connect database, {}.".format(e))
 
-    def init(self, genesis_block: Block, batch_size=None):
+    def init(self, genesis_block: Block, batch_size=None, verify_depth=0):
+        # verify_depth: 0=trust checkpoint, N=check last N blocks, None=check all blocks
         assert self.db, 'Why database connection failed?'
         if batch_size is None:
             batch_size = self.cashe_limit
+        if self.db.read_meta(META_UTXO_BUILT) is None:
+            self.db.rebuild_utxo()
+        self.db.load_bloom()
+        self.journal = Journal(os.path.join(V.DB_HOME_DIR, 'db', 'journal.dat'))
         # GenesisBlockか確認
         t = time.time()
         try:
@@ -465,18 +832,42 @@ class ChainBuilder:
             # GenesisBlockしか無いのでDummyBlockを入れる処理
             self.root_block = Block()
             self.root_block.hash = b'\xff' * 32
-            self.chain[genesis_block.hash] = genesis_block
-            self.best_chain = [genesis_block]
-            self.best_block = genesis_block
+            memorized_blocks = [genesis_block]
+            for block in self.journal.read_iter():
+                if block.height > 0:
+                    memorized_blocks.append(block)
+            self.journal.write_blocks(memorized_blocks)
+            for block in reversed(self.restore_chain(memorized_blocks)):
+                for tx in block.txs:
+                    if tx.hash not in tx_builder.chained_tx:
+                        tx_builder.chained_tx[tx.hash] = tx
             logging.info("Set dummy block. GenesisBlock={}".format(genesis_block))
             user_account.init()
             return
 
-        # 0HeightよりBlockを取得して確認
-        before_block = genesis_block
-        batch_blocks = list()
-        for height, blockhash in self.db.read_block_hash_iter(start_height=1):
-            block = self.db.read_block(blockhash)
+        # checkpointより前は確認済み
+        checkpoint = self.db.read_checkpoint()
+        if checkpoint is None or verify_depth is None:
+            start_height = 1
+        else:
+            checkpoint_height, checkpoint_hash = checkpoint
+            if self.db.read_block_hash(checkpoint_height) != checkpoint_hash:
+                raise BlockBuilderError("Checkpoint hash don't match DB [{}!={}]".format(
+                    hexlify(checkpoint_hash).decode(), self.db.read_block_hash(checkpoint_height)))
+            start_height = max(1, checkpoint_height - verify_depth + 1)
+            logging.info("Trust checkpoint {} and check from {} height."
+                         .format(checkpoint_height, start_height))
+        # pruned blockは確認できない
+        pruned_height = self.db.read_pruned_height()
+        if pruned_height is not None and start_height <= pruned_height + 1:
+            start_height = pruned_height + 2
+            logging.info("Pruned database, check from {} height.".format(start_height))
+        # start_heightよりBlockを取得して確認
+        if start_height == 1:
+            before_block = genesis_block
+        else:
+            before_block = self.db.read_block(self.db.read_block_hash(start_height - 1))
+        for height, block in self.db.read_blocks_range(start_height=start_height):
             if block.previous_hash != before_block.hash:
                 raise BlockBuilderError("PreviousHash != BlockHash [{}!={}]"
                                         .format(block, before_block))
@@ -493,6 +884,10 @@ class ChainBuilder:
                 # inputs
                 for txhash, txindex in tx.inputs:
                     input_tx = self.db.read_tx(txhash)
+                    if input_tx is None:
+                        if pruned_height is not None:
+                            continue  # all spent and pruned, index rows are removed too
+                        raise BlockBuilderError("Not found input tx {}".format(hexlify(txhash).decode()))
                     address, coin_id, amount = input_tx.outputs[txindex]
                     _coin_id, _amount, f_used = self.db.read_address_idx(address, txhash, txindex)
                     usedindex = self.db.read_usedindex(txhash)
@@ -511,43 +906,71 @@ class ChainBuilder:
                                                 .format(coin_id, _coin_id, amount, _amount))
             # Block確認終了
             before_block = block
-            batch_blocks.append(block)
-            if len(batch_blocks) >= batch_size:
-                user_account.new_batch_apply(batch_blocks)
-                batch_blocks.clear()
-                logging.debug("UserAccount batched at {} height.".format(block.height))
-        # import from starter.dat
+        # import from journal.dat
         self.root_block = before_block
-        memorized_blocks, self.best_block = self.load_starter(before_block)
+        memorized_blocks = self.load_journal(before_block)
+        # UserAccount update, balance table follows DataBase
+        user_account.init()
         # Memory化されたChainを直接復元
-        for block in memorized_blocks:
-            batch_blocks.append(block)
-            self.chain[block.hash] = block
+        for block in reversed(self.restore_chain(memorized_blocks)):
             for tx in block.txs:
                 if tx.hash not in tx_builder.chained_tx:
                     tx_builder.chained_tx[tx.hash] = tx
                 if tx.hash in tx_builder.unconfirmed:
                     del tx_builder.unconfirmed[tx.hash]
-        self.best_chain = list(reversed(memorized_blocks))
-        # UserAccount update
-        user_account.new_batch_apply(batch_blocks)
-        user_account.init()
+                user_account.affect_new_tx(tx)
         logging.info("Init finished, last block is {} {}Sec"
                      .format(before_block, round(time.time()-t, 3)))
 
-    def save_starter(self):
-        for index in reversed(range(STARTER_NUM)):
+    def restore_chain(self, blocks):
+        # blocks on memory include fork, return best_chain
+        for block in blocks:
+            if block.hash in self.chain:
+                continue
+            elif self.root_block.height is not None and block.height <= self.root_block.height:
+                continue
+            self.chain[block.hash] = block
+            self.add_spent_index(block)
+        self.rebuild_chain_score()
+        # 同scoreなら新しいBlockを優先
+        best_block = None
+        self.best_score = 0.0
+        for block in self.chain.values():
+            score = self.chain_score.get(block.hash)
+            if score is not None and score >= self.best_score:
+                best_block = block
+                self.best_score = score
+        if best_block is None:
+            raise BlockBuilderError('Not found best block on memory.')
+        dummy, best_chain = self.get_best_chain(best_block)
+        for index, block in enumerate(best_chain):
+            try: best_chain[index+1].next_hash = block.hash
+            except IndexError: pass
+            for tx in block.txs:
+                tx.height = block.height
+        self.best_block, self.best_chain = best_block, best_chain
+        self.update_best_chain_index(old_blocks=list(), new_blocks=best_chain)
+        logging.debug("Restore {} blocks, best={}".format(len(self.chain), best_block))
+        return best_chain
+
+    def load_journal(self, root_block):
+        self.failmark_file_check()
+        memorized_blocks = [block for block in self.journal.read_iter()
+                            if block.height > root_block.height]
+        if len(memorized_blocks) > 0:
+            logging.debug("Load {} blocks from journal.".format(len(memorized_blocks)))
+            return memorized_blocks
+        # old version, convert starter.n.dat to journal
+        memorized_blocks, dummy = self.load_starter(root_block)
+        self.journal.write_blocks(memorized_blocks)
+        for index in range(STARTER_NUM+1):
             target_path = os.path.join(V.DB_HOME_DIR, 'db', 'starter.{}.dat'.format(index))
             if os.path.exists(target_path):
-                old_file_path = os.path.join(V.DB_HOME_DIR, 'db', 'starter.{}.dat'.format(index+1))
-                if os.path.exists(old_file_path):
-                    os.remove(old_file_path)
-                os.rename(target_path, old_file_path)
-        with open(os.path.join(V.DB_HOME_DIR, 'db', 'starter.0.dat'), mode='bw') as fp:
-            pickle.dump(self.best_chain, fp, protocol=4)
+                os.remove(target_path)
+        logging.info("Convert starter.n.dat to journal.")
+        return memorized_blocks
 
     def load_starter(self, root_block):
-        self.failmark_file_check()
         memorized_blocks = list()
         for index in range(STARTER_NUM+1):
             target_path = os.path.join(V.DB_HOME_DIR, 'db', 'starter.{}.dat'.format(index))
@@ -566,6 +989,14 @@ class ChainBuilder:
         mark_file = os.path.join(V.DB_HOME_DIR, 'db', 'starter.failed.dat')
         if not os.path.exists(mark_file):
             return
+        # journalの新しい半分を捨てる
+        heights = {block.height for block in self.journal.read_iter()}
+        if len(heights) > 1:
+            limit = sorted(heights)[len(heights) // 2 - 1]
+            self.journal.rewrite(check=lambda x: x <= limit)
+            os.remove(mark_file)
+            logging.debug("Removed journal blocks higher than {}.".format(limit))
+            return
         for index in range(STARTER_NUM+1):
             target_path = os.path.join(V.DB_HOME_DIR, 'db', 'starter.{}.dat'.format(index))
             if os.path.exists(target_path):
@@ -603,34 +1034,48 @@ class ChainBuilder:
                 previous_hash = block.previous_hash
                 best_chain.append(block)
             return best_block, best_chain
-        # BestBlockがchainにおける
-        best_score = 0.0
-        best_block = None
-        best_chain = list()
-        for block in list(self.chain.values()):
-            if block in best_chain:
-                continue
-            tmp_best_score = block.score
-            tmp_best_block = block
-            tmp_best_chain = [block]
-            while block.previous_hash in self.chain:
-                block = self.chain[block.previous_hash]
-                tmp_best_score += block.score
-                tmp_best_chain.append(block)
-            else:
-                if self.root_block.hash != block.previous_hash:
-                    continue
-            if best_score > tmp_best_score:
-                continue
-            best_score = tmp_best_score
-            best_block = tmp_best_block
-            best_chain = tmp_best_chain
-        # txのheightを揃える
-        for block in best_chain:
-            for tx in block.txs:
-                tx.height = block.height
-        # best_chain = [<height=n>, <height=n-1>, ...]
-        return best_block, best_chain
+        # new_blockで更新済み
+        return self.best_block, self.best_chain.copy()
+
+    def update_best_chain_index(self, old_blocks, new_blocks):
+        # 新しいものを先に入れる
+        for block in new_blocks:
+            self.best_chain_height[block.height] = block
+            self.best_chain_hashes.add(block.hash)
+        for block in old_blocks:
+            if self.best_chain_height.get(block.height) is block:
+                del self.best_chain_height[block.height]
+            self.best_chain_hashes.discard(block.hash)
+
+    def _connect_block(self, block):
+        # rootまで繋がったBlockのscoreを記録、繋がったBlockを返す
+        if block.previous_hash == self.root_block.hash:
+            base_score = 0.0
+        elif block.previous_hash in self.chain_score:
+            base_score = self.chain_score[block.previous_hash]
+        else:
+            self.orphan_children.setdefault(block.previous_hash, list()).append(block)
+            return list()
+        connected = list()
+        stack = [(block, base_score)]
+        while len(stack) > 0:
+            block, base_score = stack.pop()
+            self.chain_score[block.hash] = base_score + block.score
+            connected.append(block)
+            for child in self.orphan_children.pop(block.hash, list()):
+                if child.hash in self.chain:
+                    stack.append((child, self.chain_score[block.hash]))
+        return connected
+
+    def rebuild_chain_score(self):
+        self.chain_score.clear()
+        self.orphan_children.clear()
+        for block in sorted(self.chain.values(), key=lambda x: x.height):
+            self._connect_block(block)
+        if self.best_block and self.best_block.hash in self.chain_score:
+            self.best_score = self.chain_score[self.best_block.hash]
+        else:
+            self.best_score = 0.0
 
     def batch_apply(self, force=False):
         # 無チェックで挿入するから要注意
@@ -646,6 +1091,7 @@ class ChainBuilder:
             cur = db.cursor()  # DO NOT USE FOR WRITE!
             try:
                 block = None
+                pruned_height = self.db.read_pruned_height() if config['prune_depth'] else None
                 while batch_count > 0 and len(best_chain) > 0:
                     batch_count -= 1
                     block = best_chain.pop()  # 古いものから順に
@@ -665,16 +1111,22 @@ class ChainBuilder:
                             self.db.write_usedindex(txhash, usedindex)  # UsedIndex update
                             input_tx = tx_builder.get_tx(txhash)
                             address, coin_id, amount = input_tx.outputs[txindex]
+                            self.db.remove_utxo(address, txhash, txindex)
                             if config['full_address_index'] or is_address(ck=address, prefix=V.BLOCK_CONTRACT_PREFIX)\
                                     or read_address2user(address=address, cur=cur):
                                 # 必要なAddressのみ
                                 self.db.write_address_idx(address, txhash, txindex, coin_id, amount, True)
+                            # 古くて全て使用済みのTXは削除
+                            if pruned_height is not None and 0 < input_tx.height <= pruned_height \
+                                    and input_tx.type in PRUNE_TX_TYPES and len(usedindex) == len(input_tx.outputs):
+                                self.db.remove_tx(input_tx)
                         # outputs
                         for index, (address, coin_id, amount) in enumerate(tx.outputs):
                             if config['full_address_index'] or is_address(ck=address, prefix=V.BLOCK_CONTRACT_PREFIX) \
                                     or read_address2user(address=address, cur=cur):
                                 # 必要なAddressのみ
                                 self.db.write_address_idx(address, tx.hash, index, coin_id, amount, False)
+                                self.db.write_utxo(address, tx.hash, index, coin_id, amount, tx.height, tx.type)
                         # TXの種類による追加操作
                         if tx.type == C.TX_GENESIS:
                             pass
@@ -701,14 +1153,21 @@ class ChainBuilder:
                                                    finish_hash=tx.hash, message=(c_method, c_args, c_storage))
 
                 # block挿入終了
-                self.best_chain = best_chain
-                self.root_block = block
-                self.db.batch_commit()
-                self.save_starter()
-                # root_blockよりHeightの小さいBlockを消す
-                for blockhash, block in self.chain.copy().items():
-                    if self.root_block.height >= block.height:
-                        del self.chain[blockhash]
+                if config['prune_depth']:
+                    self.prune_old_blocks(stop_height=block.height - config['prune_depth'])
+                self.db.write_checkpoint(block.height, block.hash)
+                root_height = block.height
+                with self.lock:
+                    self.db.batch_commit(on_written=lambda: self.journal.truncate(root_height))
+                    self.best_chain = best_chain
+                    self.root_block = block
+                    # root_blockよりHeightの小さいBlockを消す
+                    for blockhash, block in self.chain.copy().items():
+                        if self.root_block.height >= block.height:
+                            del self.chain[blockhash]
+                            self.remove_spent_index(block)
+                    self.update_best_chain_index(old_blocks=batched_blocks, new_blocks=list())
+                    self.rebuild_chain_score()
                 logging.debug("Success batch {} blocks, root={}."
                               .format(len(batched_blocks), self.root_block))
                 # アカウントへ反映↓
@@ -719,40 +1178,107 @@ class ChainBuilder:
                 logging.warning("Failed batch block builder. '{}'".format(e), exc_info=True)
                 return list()
 
+    def prune_old_blocks(self, stop_height):
+        # remove all spent txs of blocks passing prune depth, in batch
+        pruned_height = self.db.read_pruned_height() or 0
+        stop_height = min(stop_height, pruned_height + PRUNE_SWEEP_LIMIT)
+        if stop_height <= pruned_height:
+            return
+        blockhashes = list()
+        for height, blockhash in self.db.read_block_hash_iter(start_height=pruned_height + 1):
+            if stop_height < height:
+                break
+            blockhashes.append(blockhash)
+        txhashes = list()
+        for b in self.db._read_many('_block', blockhashes).values():
+            txhashes.extend(decode_block(b)[1])
+        txs = self.db.read_txs_many(txhashes)
+        usedindexes = self.db._read_many('_used_index', list(txs))
+        count = 0
+        for tx in txs.values():
+            if tx.type in PRUNE_TX_TYPES and len(usedindexes.get(tx.hash, b'')) == len(tx.outputs):
+                self.db.remove_tx(tx)
+                count += 1
+        self.db.write_pruned_height(stop_height)
+        logging.debug("Pruned {} txs, pruned height {}.".format(count, stop_height))
+
     def new_block(self, block):
+        self.journal.append(block, sync=self.db.sync)
+        with self.lock:
+            self._new_block(block)
+
+    def _new_block(self, block):
         # とりあえず新規に挿入
         self.chain[block.hash] = block
-        # BestChainの変化を調べる
-        new_best_block, new_best_chain = self.get_best_chain()
-        if new_best_block == self.best_block:
+        self.add_spent_index(block)
+        # BestChainの変化を調べる、同scoreなら新しいBlockを優先
+        new_best_block = None
+        new_best_score = self.best_score
+        for connected in self._connect_block(block):
+            if self.chain_score[connected.hash] >= new_best_score:
+                new_best_block = connected
+                new_best_score = self.chain_score[connected.hash]
+        if new_best_block is None or new_best_block == self.best_block:
             return  # 操作を加える必要は無い
+        # 分岐点まで遡る
+        old_best_chain = self.best_chain
+        new_blocks = list()
+        fork_block = new_best_block
+        while fork_block.hash not in self.best_chain_hashes:
+            new_blocks.append(fork_block)
+            if fork_block.previous_hash == self.root_block.hash:
+                fork_block = None
+                break
+            fork_block = self.chain[fork_block.previous_hash]
+        if fork_block is None:
+            old_blocks = old_best_chain
+            new_best_chain = new_blocks
+        else:
+            fork_index = old_best_chain[0].height - fork_block.height
+            assert old_best_chain[fork_index] == fork_block, 'Not found fork block.'
+            old_blocks = old_best_chain[:fork_index]
+            new_best_chain = new_blocks + old_best_chain[fork_index:]
         # tx heightを合わせる
-        old_best_chain = self.best_chain.copy()
-        commons = set(new_best_chain) & set(old_best_chain)
-        for index, block in enumerate(old_best_chain):
-            if block not in commons:
-                try: old_best_chain[index+1].next_hash = None
-                except IndexError: pass
-                for tx in block.txs:
-                    tx.height = None
-        for index, block in enumerate(new_best_chain):
-            if block not in commons:
-                try: new_best_chain[index+1].next_hash = block.hash
-                except IndexError: pass
-                for tx in block.txs:
-                    tx.height = block.height
+        for index, old_block in enumerate(old_blocks):
+            try: old_best_chain[index+1].next_hash = None
+            except IndexError: pass
+            for tx in old_block.txs:
+                tx.height = None
+        for index, new_block in enumerate(new_blocks):
+            try: new_best_chain[index+1].next_hash = new_block.hash
+            except IndexError: pass
+            for tx in new_block.txs:
+                tx.height = new_block.height
         # 変化しているので反映する
-        self.best_block, self.best_chain = new_best_block, new_best_chain
+        self.best_block, self.best_chain, self.best_score = new_best_block, new_best_chain, new_best_score
+        self.update_best_chain_index(old_blocks=old_blocks, new_blocks=new_blocks)
         tx_builder.affect_new_chain(
-            new_best_chain=set(new_best_chain) - commons,
-            old_best_chain=set(old_best_chain) - commons)
+            new_best_chain=set(new_blocks),
+            old_best_chain=set(old_blocks))
+
+    def add_spent_index(self, block):
+        for tx in block.txs:
+            for txhash, txindex in tx.inputs:
+                self.spent_index.setdefault(txhash, dict()).setdefault(txindex, dict())[block.hash] = tx.hash
+
+    def remove_spent_index(self, block):
+        for tx in block.txs:
+            for txhash, txindex in tx.inputs:
+                used = self.spent_index.get(txhash)
+                if used is None or txindex not in used:
+                    continue
+                used[txindex].pop(block.hash, None)
+                if len(used[txindex]) == 0:
+                    del used[txindex]
+                if len(used) == 0:
+                    del self.spent_index[txhash]
 
     def get_block(self, blockhash):
         if blockhash in self.chain:
             # Memoryより
             block = self.chain[blockhash]
             block.f_on_memory = True
-            block.f_orphan = bool(block not in self.best_chain)
+            block.f_orphan = bool(block.hash not in self.best_chain_hashes)
         else:
             # DataBaseより
             block = self.db.read_block(blockhash)
@@ -763,25 +1289,152 @@ class ChainBuilder:
                 return None
         return block
 
+    def snapshot(self):
+        return ChainSnapshot(self)
+
     def get_block_hash(self, height):
         if height > self.best_block.height:
             return None
         elif height < 0:
             return None
         # Memory
-        for block in self.best_chain:
-            if height == block.height:
-                return block.hash
+        block = self.best_chain_height.get(height)
+        if block is not None:
+            return block.hash
         # DataBase
         return self.db.read_block_hash(height)
 
 
+class ChainSnapshot:
+    """ frozen memory chain and database snapshot, hold while one request """
+
+    def __init__(self, chain_builder):
+        assert chain_builder.root_block, 'Do not init.'
+        with chain_builder.lock:
+            self.db = chain_builder.db.snapshot()
+            self.chain = chain_builder.chain.copy()
+            self.best_chain = chain_builder.best_chain.copy()
+            self.root_block = chain_builder.root_block
+            self.best_block = chain_builder.best_block
+            self.best_chain_height = chain_builder.best_chain_height.copy()
+            self.best_chain_hashes = frozenset(chain_builder.best_chain_hashes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    # same readers as ChainBuilder
+    get_best_chain = ChainBuilder.get_best_chain
+    get_block = ChainBuilder.get_block
+    get_block_hash = ChainBuilder.get_block_hash
+
+
+class TxCashe:
+    """ LRU cashe of decoded confirmed tx read from database """
+
+    def __init__(self, limit=C.TX_CASHE_LIMIT):
+        self.limit = limit
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, txhash):
+        with self.lock:
+            tx = self.data.get(txhash)
+            if tx is not None:
+                self.data.move_to_end(txhash)
+                self.hits += 1
+            return tx
+
+    def miss(self):
+        # only when read from database
+        with self.lock:
+            self.misses += 1
+
+    def put(self, tx):
+        with self.lock:
+            self.data[tx.hash] = tx
+            self.data.move_to_end(tx.hash)
+            while len(self.data) > self.limit:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def remove(self, txhash):
+        with self.lock:
+            if self.data.pop(txhash, None) is not None:
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.evictions += len(self.data)
+            self.data.clear()
+
+    @property
+    def info(self):
+        return {
+            'size': len(self.data),
+            'limit': self.limit,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions}
+
+
+class UnconfirmedPool(dict):
+    """ unconfirmed tx dict with index of spent outputs """
+
+    def __init__(self):
+        super().__init__()
+        # {txhash: {txindex: {spender_txhash,..}}}
+        self.spent = dict()
+
+    def __setitem__(self, txhash, tx):
+        if txhash in self:
+            del self[txhash]
+        super().__setitem__(txhash, tx)
+        for input_hash, input_index in tx.inputs:
+            self.spent.setdefault(input_hash, dict()).setdefault(input_index, set()).add(txhash)
+
+    def __delitem__(self, txhash):
+        tx = self[txhash]
+        super().__delitem__(txhash)
+        for input_hash, input_index in tx.inputs:
+            used = self.spent.get(input_hash)
+            if used is None or input_index not in used:
+                continue
+            used[input_index].discard(txhash)
+            if len(used[input_index]) == 0:
+                del used[input_index]
+            if len(used) == 0:
+                del self.spent[input_hash]
+
+    def pop(self, txhash, *args):
+        if txhash not in self:
+            return super().pop(txhash, *args)
+        tx = self[txhash]
+        del self[txhash]
+        return tx
+
+    def clear(self):
+        super().clear()
+        self.spent.clear()
+
+
 class TransactionBuilder:
     def __init__(self):
         # BLockに存在するTXのみ保持すればよい
-        self.unconfirmed = dict()  # Blockに取り込まれた事のないTX、参照保持用
+        self.unconfirmed = UnconfirmedPool()  # Blockに取り込まれた事のないTX、参照保持用
         self.chained_tx = weakref.WeakValueDictionary()  # 一度でもBlockに取り込まれた事のあるTX
-        self.tmp = weakref.WeakValueDictionary()  # 一時的
+        self.cashe = TxCashe()  # DataBaseより読んだTX
 
     def put_unconfirmed(self, tx, outer_cur=None):
         assert tx.height is None, 'Not unconfirmed tx {}'.format(tx)
@@ -798,8 +1451,9 @@ class TransactionBuilder:
         NewInfo.put(obj=tx)
 
     def get_tx(self, txhash, default=None):
-        if txhash in self.tmp:
-            return self.tmp[txhash]
+        tx = self.cashe.get(txhash)
+        if tx is not None:
+            return tx
         elif txhash in self.unconfirmed:
             # unconfirmedより
             tx = self.unconfirmed[txhash]
@@ -812,10 +1466,11 @@ class TransactionBuilder:
             if tx.height is None: logging.warning("Is unconfirmed. {}".format(tx))
         else:
             # Databaseより
+            self.cashe.miss()
             tx = builder.db.read_tx(txhash)
             if tx:
                 tx.f_on_memory = False
-                self.tmp[txhash] = tx
+                self.cashe.put(tx)
             else:
                 return default
         return tx
@@ -833,6 +1488,7 @@ class TransactionBuilder:
         # 状態を戻す
         for block in old_best_chain:
             for tx in block.txs:
+                self.cashe.remove(tx.hash)
                 if tx.hash not in self.unconfirmed and tx.type not in (C.TX_POW_REWARD, C.TX_POS_REWARD):
                     self.unconfirmed[tx.hash] = tx
                 if tx.hash in self.chained_tx:
@@ -865,62 +1521,83 @@ class TransactionBuilder:
 
 class UserAccount:
     def __init__(self):
+        # confirmed balance, same as `balance` table
         self.db_balance = UserCoins()
-        # {txhash: (_type, movement, _time),..}
+        # {txhash: MoveLog,..} of memory chain and unconfirmed txs
         self.memory_movement = dict()
 
     def init(self, f_delete=False):
         assert f_delete is False, 'Unsafe function!'
+        root_height = builder.root_block.height if builder.root_block else None
         with closing(create_db(V.DB_ACCOUNT_PATH)) as db:
             cur = db.cursor()
-            memory_sum = UserCoins()
-            for move_log in read_log_iter(cur):
-                # logに記録されてもBlockに取り込まれていないならTXは存在せず
-                if builder.db.read_tx(move_log.txhash):
-                    memory_sum += move_log.movement
-                else:
-                    logging.debug("It's unknown log {}".format(move_log))
-                    if f_delete:
-                        delete_log(move_log.txhash, cur)
-            if f_delete:
-                logging.warning("Delete user's old unconfirmed tx.")
-                db.commit()
-            self.db_balance += memory_sum
+            balance_height = read_balance_height(cur)
+            pruned_height = builder.db.read_pruned_height()
+            if balance_height is not None and root_height is not None and \
+                    (root_height < balance_height or
+                     (pruned_height is not None and balance_height < pruned_height)):
+                logging.warning("Balance table is not follow DataBase, rebuild. [{} {}]"
+                                .format(balance_height, root_height))
+                balance_height = None
+            if balance_height is None:
+                if pruned_height is not None:
+                    # logのTXが削除済みか未承認か区別できない
+                    raise BlockBuilderError("Cannot rebuild balance table on pruned database, "
+                                            "please resync database with prune_depth=0.")
+                # 初回のみlogより作成する
+                self.rebuild_balance(root_height, cur)
+            db.commit()
+            self.db_balance = read_balance(cur)
+        if balance_height is not None and root_height is not None and balance_height < root_height:
+            # batch後にaccount.datへ書き込む前に終了した分
+            logging.info("Apply {} blocks to balance table.".format(root_height - balance_height))
+            batch_blocks = list()
+            for height, block in builder.db.read_blocks_range(balance_height + 1, root_height + 1):
+                batch_blocks.append(block)
+            self.new_batch_apply(batch_blocks)
+
+    def rebuild_balance(self, root_height, cur):
+        delete_balance(cur)
+        balance = UserCoins()
+        for move_log in read_log_iter(cur):
+            # logに記録されてもBlockに取り込まれていないならTXは存在せず
+            if move_log.type == C.TX_INNER or builder.db.read_tx(move_log.txhash):
+                balance += move_log.movement
+            else:
+                logging.debug("It's unknown log {}".format(move_log))
+        update_balance(balance, cur)
+        if root_height is not None:
+            write_balance_height(root_height, cur)
+        logging.info("Rebuild balance table at {} height.".format(root_height))
 
     def get_balance(self, confirm=6):
         assert confirm < builder.cashe_limit - builder.batch_size, 'Too few cashe size.'
         assert builder.best_block, 'Not DataBase init.'
         # DataBase
         balance = self.db_balance.copy()
-        with closing(create_db(V.DB_ACCOUNT_PATH)) as db:
-            cur = db.cursor()
-            # Memory
-            limit_height = builder.best_block.height - confirm
-            for block in builder.best_chain:
-                for tx in block.txs:
-                    move_log = read_txhash2log(tx.hash, cur)
-                    if move_log is None:
-                        if tx.hash in self.memory_movement:
-                            move_log = self.memory_movement[tx.hash]
-                    if move_log:
-                        for user, coins in move_log.movement.items():
-                            for coin_id, amount in coins:
-                                if limit_height < block.height:
-                                    if amount < 0:
-                                        balance.add_coins(user, coin_id, amount)
-                                else:
-                                    balance.add_coins(user, coin_id, amount)
-            # Unconfirmed
-            for tx in list(tx_builder.unconfirmed.values()):
-                move_log = read_txhash2log(tx.hash, cur)
+        # Memory
+        limit_height = builder.best_block.height - confirm
+        for block in builder.best_chain:
+            for tx in block.txs:
+                move_log = self.memory_movement.get(tx.hash)
                 if move_log is None:
-                    if tx.hash in self.memory_movement:
-                        move_log = self.memory_movement[tx.hash]
-                if move_log:
-                    for user, coins in move_log.movement.items():
-                        for coin_id, amount in coins:
+                    continue
+                for user, coins in move_log.movement.items():
+                    for coin_id, amount in coins:
+                        if limit_height < block.height:
                             if amount < 0:
                                 balance.add_coins(user, coin_id, amount)
+                        else:
+                            balance.add_coins(user, coin_id, amount)
+        # Unconfirmed
+        for tx in list(tx_builder.unconfirmed.values()):
+            move_log = self.memory_movement.get(tx.hash)
+            if move_log is None:
+                continue
+            for user, coins in move_log.movement.items():
+                for coin_id, amount in coins:
+                    if amount < 0:
+                        balance.add_coins(user, coin_id, amount)
         return balance
 
     def move_balance(self, _from, _to, coins, outer_cur=None):
@@ -933,6 +1610,7 @@ class UserAccount:
                 movements[_from] -= coins
                 movements[_to] += coins
                 txhash = insert_log(movements, cur)
+                update_balance(movements, cur)
                 if outer_cur is None:
                     db.commit()
                 self.db_balance += movements
@@ -990,24 +1668,35 @@ class UserAccount:
     def new_batch_apply(self, batched_blocks):
         with closing(create_db(V.DB_ACCOUNT_PATH)) as db:
             cur = db.cursor()
+            balance_height = read_balance_height(cur)
+            movements = UserCoins()
             for block in batched_blocks:
+                if balance_height is not None and block.height <= balance_height:
+                    continue  # already applied
                 for tx in block.txs:
                     move_log = read_txhash2log(tx.hash, cur)
                     if move_log:
                         # User操作の記録
-                        self.db_balance += move_log.movement
+                        movements += move_log.movement
                         if tx.hash in self.memory_movement:
                             del self.memory_movement[tx.hash]
                         # logging.debug("Already recoded log {}".format(tx))
                     elif tx.hash in self.memory_movement:
                         # db_balanceに追加
                         _type, movement, _time = self.memory_movement[tx.hash].get_tuple_data()
-                        self.db_balance += movement
+                        movements += movement
                         # memory_movementから削除
                         del self.memory_movement[tx.hash]
                         # insert_log
                         insert_log(movement, cur, _type, _time, tx.hash)
+                balance_height = block.height
+            if balance_height is None:
+                return
+            # logとbalanceは同じtransactionで書き込む
+            update_balance(movements, cur)
+            write_balance_height(balance_height, cur)
             db.commit()
+            self.db_balance += movements
 
     def affect_new_tx(self, tx, outer_cur=None):
         with closing(create_db(V.DB_ACCOUNT_PATH)) as db:
@@ -1016,6 +1705,13 @@ class UserAccount:
             # send_from_applyで登録済み
             if tx.hash in self.memory_movement:
                 return
+            # logに記録済みならそのmovementを使う
+            move_log = read_txhash2log(tx.hash, cur)
+            if move_log is not None:
+                move_log.on_memory = True
+                move_log.pointer = weakref.ref(tx)
+                self.memory_movement[tx.hash] = move_log
+                return
             # memory_movementに追加
             for txhash, txindex in tx.inputs:
                 input_tx = tx_builder.get_tx(txhash)
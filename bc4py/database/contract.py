@@ -133,10 +133,11 @@ def encode(*args):
     return bjson.dumps(args, compress=False)
 
 
-def contract_fill(c: Contract, best_block=None, best_chain=None, stop_txhash=None):
+def contract_fill(c: Contract, best_block=None, best_chain=None, stop_txhash=None, snapshot=None):
     assert c.index == -1, 'Already updated'
+    chain = snapshot or builder  # ChainSnapshot for readers
     # database
-    c_iter = builder.db.read_contract_iter(c_address=c.c_address)
+    c_iter = chain.db.read_contract_iter(c_address=c.c_address)
     for index, start_hash, finish_hash, (c_method, c_args, c_storage) in c_iter:
         if finish_hash == stop_txhash:
             return
@@ -145,10 +146,10 @@ def contract_fill(c: Contract, best_block=None, best_chain=None, stop_txhash=Non
     # memory
     if best_chain:
         _best_chain = None
-    elif best_block and best_block == builder.best_block:
-        _best_chain = builder.best_chain
+    elif best_block and best_block == chain.best_block:
+        _best_chain = chain.best_chain
     else:
-        dummy, _best_chain = builder.get_best_chain(best_block=best_block)
+        dummy, _best_chain = chain.get_best_chain(best_block=best_block)
     for block in reversed(best_chain or _best_chain):
         for tx in block.txs:
             if tx.hash == stop_txhash:
@@ -178,7 +179,7 @@ def contract_fill(c: Contract, best_block=None, best_chain=None, stop_txhash=Non
                      c_method=c_method, c_args=c_args, c_storage=c_storage)
 
 
-def get_contract_object(c_address, best_block=None, best_chain=None, stop_txhash=None):
+def get_contract_object(c_address, best_block=None, best_chain=None, stop_txhash=None, snapshot=None):
     if best_block:
         key = (best_block.hash, stop_txhash)
         if key in cashe:
@@ -186,15 +187,16 @@ def get_contract_object(c_address, best_block=None, best_chain=None, stop_txhash
     else:
         key = None
     c = Contract(c_address=c_address)
-    contract_fill(c=c, best_block=best_block, best_chain=best_chain, stop_txhash=stop_txhash)
+    contract_fill(c=c, best_block=best_block, best_chain=best_chain, stop_txhash=stop_txhash, snapshot=snapshot)
     if key:
         cashe[key] = c
     return c
 
 
-def get_conclude_hash_by_start_hash(c_address, start_hash, best_block=None, best_chain=None, stop_txhash=None):
+def get_conclude_hash_by_start_hash(c_address, start_hash, best_block=None, best_chain=None, stop_txhash=None, snapshot=None):
+    chain = snapshot or builder  # ChainSnapshot for readers
     # database
-    c_iter = builder.db.read_contract_iter(c_address=c_address)
+    c_iter = chain.db.read_contract_iter(c_address=c_address)
     for index, _start_hash, finish_hash, (c_method, c_args, c_storage) in c_iter:
         if finish_hash == stop_txhash:
             return None
@@ -203,10 +205,10 @@ def get_conclude_hash_by_start_hash(c_address, start_hash, best_block=None, best
     # memory
     if best_chain:
         _best_chain = None
-    elif best_block and best_block == builder.best_block:
-        _best_chain = builder.best_chain
+    elif best_block and best_block == chain.best_block:
+        _best_chain = chain.best_chain
     else:
-        dummy, _best_chain = builder.get_best_chain(best_block=best_block)
+        dummy, _best_chain = chain.get_best_chain(best_block=best_block)
     for block in reversed(best_chain or _best_chain):
         for tx in block.txs:
             if tx.hash == stop_txhash:
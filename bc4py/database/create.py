@@ -63,6 +63,18 @@ def make_account_db():
             `user` INTEGER NOT NULL,
             `time` INTEGER NOT NULL
         )""")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS `balance` (
+            `user` INTEGER NOT NULL,
+            `coin_id` INTEGER NOT NULL,
+            `amount` INTEGER NOT NULL,
+            PRIMARY KEY (`user`,`coin_id`)
+        )""")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS `meta` (
+            `key` TEXT PRIMARY KEY,
+            `value` INTEGER NOT NULL
+        )""")
         # index
         sql = [
             "CREATE INDEX IF NOT EXISTS 'hash_idx' ON `log` (`hash`,`index`)",
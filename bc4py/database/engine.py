@@ -0,0 +1,481 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+
+from bc4py.config import V
+import os
+import sys
+import shutil
+import logging
+import threading
+import copy
+import time
+from bisect import bisect_left, insort
+
+# http://blog.livedoor.jp/wolf200x/archives/53052954.html
+# https://github.com/happynear/py-leveldb-windows
+# https://tangerina.jp/blog/leveldb-1.20-build/
+
+
+try:
+    import plyvel
+    is_plyvel = True
+    LevelDBError = plyvel.Error
+except ImportError:
+    import leveldb
+    is_plyvel = False
+    LevelDBError = leveldb.LevelDBError
+
+
+database_tuple = ("_block", "_tx", "_used_index", "_block_index",
+                  "_address_index", "_coins", "_contract", "_validator",
+                  "_utxo", "_meta")
+# tables added later, created on old database too
+added_tables = ("_utxo", "_meta")
+# separated layout, one LevelDB directory per table
+table_dirs = {
+    "_block": "block",
+    "_tx": "tx",
+    "_used_index": "used-index",
+    "_block_index": "block-index",
+    "_address_index": "address-index",
+    "_coins": "coins",
+    "_contract": "contract",
+    "_validator": "validator",
+    "_utxo": "utxo",
+    "_meta": "meta"}
+# unified layout, one LevelDB and one byte key prefix per table
+# Do not change numbers, they are written to disk.
+table_prefix = {
+    "_block": b'\x01',
+    "_tx": b'\x02',
+    "_used_index": b'\x03',
+    "_block_index": b'\x04',
+    "_address_index": b'\x05',
+    "_coins": b'\x06',
+    "_contract": b'\x07',
+    "_validator": b'\x08',
+    "_utxo": b'\x09',
+    "_meta": b'\x0a'}
+UNIFIED_DIR = 'chain'
+
+
+def create_level_db(path, create_if_missing, cache_size=None, block_size=None, write_buffer_size=None):
+    # None means LevelDB default
+    kwargs = dict()
+    if is_plyvel:
+        if cache_size:
+            kwargs['lru_cache_size'] = cache_size
+        if block_size:
+            kwargs['block_size'] = block_size
+        if write_buffer_size:
+            kwargs['write_buffer_size'] = write_buffer_size
+        return plyvel.DB(path, create_if_missing=create_if_missing, **kwargs)
+    else:
+        if cache_size:
+            kwargs['block_cache_size'] = cache_size
+        if block_size:
+            kwargs['block_size'] = block_size
+        if write_buffer_size:
+            kwargs['write_buffer_size'] = write_buffer_size
+        return leveldb.LevelDB(path, create_if_missing=create_if_missing, **kwargs)
+
+
+def _level_compact(db, start, stop):
+    if is_plyvel:
+        db.compact_range(start=start, stop=stop)
+    else:
+        db.CompactRange(key_from=start, key_to=stop)
+
+
+def _level_approximate_size(db, start, stop):
+    # None if not supported
+    if is_plyvel and hasattr(db, 'approximate_size'):
+        return db.approximate_size(start, stop)
+    return None
+
+
+def _level_compaction_bytes(db):
+    # sum of Write(MB) column of "leveldb.stats", None if not supported
+    if is_plyvel:
+        stats = db.get_property(b'leveldb.stats')
+    elif hasattr(db, 'GetStats'):
+        stats = db.GetStats().encode()
+    else:
+        return None
+    if not stats:
+        return None
+    total = 0.0
+    for line in stats.decode(errors='ignore').split('\n'):
+        cols = line.split()
+        # Level Files Size(MB) Time(sec) Read(MB) Write(MB)
+        if len(cols) == 6 and cols[0].isdigit():
+            total += float(cols[5])
+    return int(total * 1024 * 1024)
+
+
+def _dir_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, file)) for file in files)
+    return size
+
+
+def _level_snapshot(db):
+    if is_plyvel:
+        return db.snapshot()
+    else:
+        return db.CreateSnapshot()
+
+
+def _level_close(db, is_snapshot):
+    if not is_plyvel:
+        return  # released by GC
+    elif is_snapshot:
+        db.release()
+    else:
+        db.close()
+
+
+def _level_get(db, k):
+    if is_plyvel:
+        b = db.get(k, default=None)
+    else:
+        b = db.Get(k, default=None)
+    if b is None:
+        return None
+    return bytes(b)
+
+
+def _level_get_many(db, keys):
+    # keys are sorted, walk forward with one iterator
+    if is_plyvel:
+        level_iter = db.iterator()
+        try:
+            for k in keys:
+                level_iter.seek(k)
+                item = next(level_iter, None)
+                if item is None or item[0] != k:
+                    yield k, None
+                else:
+                    yield k, bytes(item[1])
+        finally:
+            level_iter.close()
+    else:
+        for k in keys:
+            yield k, _level_get(db, k)
+
+
+def _level_iter(db, start, stop, reverse=False):
+    if is_plyvel:
+        level_iter = db.iterator(start=start, stop=stop, reverse=reverse)
+    else:
+        level_iter = db.RangeIter(key_from=start, key_to=stop, reverse=reverse)
+    for k, v in level_iter:
+        yield bytes(k), bytes(v)
+
+
+def _level_iter_keys(db, start, stop):
+    if is_plyvel:
+        level_iter = db.iterator(start=start, stop=stop, include_value=False)
+    else:
+        level_iter = db.RangeIter(key_from=start, key_to=stop, include_value=False)
+    for k in level_iter:
+        yield bytes(k)
+
+
+def _level_write(db, items, sync):
+    # value None means delete the key
+    if is_plyvel:
+        batch = db.write_batch(sync=sync)
+        for k, v in items:
+            if v is None:
+                batch.delete(k)
+            else:
+                batch.put(k, v)
+        batch.write()
+    else:
+        batch = leveldb.WriteBatch()
+        for k, v in items:
+            if v is None:
+                batch.Delete(k)
+            else:
+                batch.Put(k, v)
+        db.Write(batch, sync=sync)
+
+
+class BatchTable(dict):
+    """ pending writes of one table, keys are kept sorted for range reads """
+
+    def __init__(self):
+        super().__init__()
+        self.sorted_keys = list()
+
+    def __setitem__(self, k, v):
+        if k not in self:
+            insort(self.sorted_keys, k)
+        super().__setitem__(k, v)
+
+    def range_items(self, start=None, stop=None):
+        # copy only the matching range, safe to write while iterating
+        keys = self.sorted_keys
+        i = 0 if start is None else bisect_left(keys, start)
+        j = len(keys) if stop is None else bisect_left(keys, stop)
+        return [(k, self[k]) for k in keys[i:j]]
+
+    def last_item(self, start, stop):
+        keys = self.sorted_keys
+        j = bisect_left(keys, stop)
+        if j > 0 and keys[j-1] >= start:
+            return keys[j-1], self[keys[j-1]]
+        return None
+
+
+def merge_iter(level_iter, batch_items):
+    # merge two sorted iterators, batch wins and None value is deleted
+    batch_iter = iter(batch_items)
+    batch_item = next(batch_iter, None)
+    for k, v in level_iter:
+        while batch_item is not None and batch_item[0] < k:
+            if batch_item[1] is not None:
+                yield batch_item
+            batch_item = next(batch_iter, None)
+        if batch_item is not None and batch_item[0] == k:
+            if batch_item[1] is not None:
+                yield batch_item
+            batch_item = next(batch_iter, None)
+        else:
+            yield k, v
+    while batch_item is not None:
+        if batch_item[1] is not None:
+            yield batch_item
+        batch_item = next(batch_iter, None)
+
+
+class EngineStats:
+    """ counters of written bytes and manual compactions """
+
+    def __init__(self):
+        self.written_bytes = 0
+        self.written_batches = 0
+        self.compactions = list()  # [(name, start_time, seconds),..]
+
+    def count_write(self, items):
+        # items is list of (key, value)
+        self.written_bytes += sum(len(k) + (len(v) if v else 0) for k, v in items)
+        self.written_batches += 1
+
+    def count_compaction(self, name, start_time):
+        self.compactions.append((name, int(start_time), round(time.time() - start_time, 3)))
+        del self.compactions[:-20]
+
+    def info(self, compaction_bytes):
+        if compaction_bytes is not None and self.written_bytes > 0:
+            write_amplification = round((self.written_bytes + compaction_bytes) / self.written_bytes, 3)
+        else:
+            write_amplification = None
+        return {
+            'written_bytes': self.written_bytes,
+            'written_batches': self.written_batches,
+            'compaction_bytes': compaction_bytes,
+            'write_amplification': write_amplification,
+            'compactions': [{'table': name, 'time': start, 'seconds': sec}
+                            for name, start, sec in self.compactions]}
+
+
+class SeparateEngine:
+    """ original layout, eight LevelDB directories """
+    unified = False
+    is_snapshot = False
+
+    def __init__(self, dirs, f_create, **options):
+        self.dirs = dirs
+        self.tables = dict()
+        self.stats = EngineStats()
+        # snapshot is not taken while writing tables one after another
+        self.lock = threading.Lock()
+        for name in database_tuple:
+            path = os.path.join(dirs, table_dirs[name])
+            self.tables[name] = create_level_db(
+                path, create_if_missing=f_create or name in added_tables, **options)
+
+    def close(self):
+        for db in self.tables.values():
+            _level_close(db, self.is_snapshot)
+
+    def snapshot(self):
+        # read only copy over LevelDB snapshots
+        with self.lock:
+            snapshot = copy.copy(self)
+            snapshot.tables = {name: _level_snapshot(db) for name, db in self.tables.items()}
+        snapshot.is_snapshot = True
+        return snapshot
+
+    def get(self, name, k):
+        return _level_get(self.tables[name], k)
+
+    def get_many(self, name, keys):
+        return _level_get_many(self.tables[name], sorted(keys))
+
+    def iterator(self, name, start=None, stop=None, reverse=False):
+        return _level_iter(self.tables[name], start, stop, reverse)
+
+    def keys(self, name):
+        return _level_iter_keys(self.tables[name], None, None)
+
+    def write(self, batch, sync):
+        # not atomic between tables, one fsync per table
+        assert not self.is_snapshot, 'Snapshot is read only.'
+        with self.lock:
+            for name, memory in batch.items():
+                items = list(memory.items())
+                _level_write(self.tables[name], items, sync)
+                self.stats.count_write(items)
+
+    def table_size(self, name):
+        return _dir_size(os.path.join(self.dirs, table_dirs[name]))
+
+    def compact(self, name):
+        t = time.time()
+        _level_compact(self.tables[name], None, None)
+        self.stats.count_compaction(name, t)
+
+    def info(self):
+        compaction_bytes = 0
+        for db in self.tables.values():
+            b = _level_compaction_bytes(db)
+            if b is None:
+                compaction_bytes = None
+                break
+            compaction_bytes += b
+        return self.stats.info(compaction_bytes)
+
+
+class UnifiedEngine:
+    """ one LevelDB, each table is distinguished by one byte key prefix """
+    unified = True
+    is_snapshot = False
+
+    def __init__(self, dirs, f_create, path=None, **options):
+        self.dirs = dirs
+        self.stats = EngineStats()
+        self.db = create_level_db(path or os.path.join(dirs, UNIFIED_DIR), create_if_missing=f_create, **options)
+
+    def close(self):
+        _level_close(self.db, self.is_snapshot)
+
+    def snapshot(self):
+        # one write batch is atomic, no lock needed
+        snapshot = copy.copy(self)
+        snapshot.db = _level_snapshot(self.db)
+        snapshot.is_snapshot = True
+        return snapshot
+
+    def get(self, name, k):
+        return _level_get(self.db, table_prefix[name] + k)
+
+    def get_many(self, name, keys):
+        prefix = table_prefix[name]
+        for k, v in _level_get_many(self.db, sorted(prefix + k for k in keys)):
+            yield k[1:], v
+
+    def iterator(self, name, start=None, stop=None, reverse=False):
+        prefix = table_prefix[name]
+        start = prefix + (start or b'')
+        stop = prefix + stop if stop else (prefix[0] + 1).to_bytes(1, 'big')
+        for k, v in _level_iter(self.db, start, stop, reverse):
+            yield k[1:], v
+
+    def keys(self, name):
+        prefix = table_prefix[name]
+        stop = (prefix[0] + 1).to_bytes(1, 'big')
+        for k in _level_iter_keys(self.db, prefix, stop):
+            yield k[1:]
+
+    def write(self, batch, sync):
+        # atomic, only one fsync
+        assert not self.is_snapshot, 'Snapshot is read only.'
+        items = [(table_prefix[name] + k, v) for name, memory in batch.items() for k, v in memory.items()]
+        _level_write(self.db, items, sync)
+        self.stats.count_write(items)
+
+    def _table_range(self, name):
+        prefix = table_prefix[name]
+        return prefix, (prefix[0] + 1).to_bytes(1, 'big')
+
+    def table_size(self, name):
+        return _level_approximate_size(self.db, *self._table_range(name))
+
+    def compact(self, name):
+        t = time.time()
+        _level_compact(self.db, *self._table_range(name))
+        self.stats.count_compaction(name, t)
+
+    def info(self):
+        return self.stats.info(_level_compaction_bytes(self.db))
+
+
+def open_engine(dirs, f_create, unified=False, **options):
+    # options: cache_size, block_size, write_buffer_size
+    if os.path.exists(os.path.join(dirs, UNIFIED_DIR)):
+        return UnifiedEngine(dirs, f_create=False, **options)
+    elif f_create and unified:
+        return UnifiedEngine(dirs, f_create=True, **options)
+    elif unified:
+        logging.warning("Found separated database, use it. Migrate by "
+                        "\"python -m bc4py.database.engine migrate\" to unify.")
+    return SeparateEngine(dirs, f_create, **options)
+
+
+def migrate_to_unified(dirs, chunk_size=10000):
+    # convert eight directories to unified layout in place
+    assert not os.path.exists(os.path.join(dirs, UNIFIED_DIR)), 'Already unified database.'
+    tmp_path = os.path.join(dirs, UNIFIED_DIR + '.tmp')
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)  # failed migration before
+    old = SeparateEngine(dirs, f_create=False)
+    new = UnifiedEngine(dirs, f_create=True, path=tmp_path)
+    try:
+        for name in database_tuple:
+            count = 0
+            memory = dict()
+            for k, v in old.iterator(name):
+                memory[k] = v
+                count += 1
+                if len(memory) >= chunk_size:
+                    new.write({name: memory}, sync=False)
+                    memory = dict()
+            new.write({name: memory}, sync=True)
+            # check
+            if count != sum(1 for dummy in new.iterator(name)):
+                raise Exception('Not match key number of {}.'.format(name))
+            logging.info("Migrate {} {}keys.".format(name, count))
+    finally:
+        old.close()
+        new.close()
+    os.rename(tmp_path, os.path.join(dirs, UNIFIED_DIR))
+    for name in database_tuple:
+        shutil.rmtree(os.path.join(dirs, table_dirs[name]))
+    logging.info("Finish migration to unified database {}.".format(dirs))
+
+
+if __name__ == '__main__':
+    # python -m bc4py.database.engine migrate [sub_dir]
+    from bc4py.utils import set_database_path
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("Usage: python -m bc4py.database.engine migrate [sub_dir]")
+        exit(1)
+    set_database_path(sub_dir=sys.argv[2] if len(sys.argv) > 2 else None)
+    migrate_to_unified(os.path.join(V.DB_HOME_DIR, 'db'))
+
+
+__all__ = [
+    "is_plyvel",
+    "LevelDBError",
+    "database_tuple",
+    "table_prefix",
+    "BatchTable",
+    "merge_iter",
+    "open_engine",
+    "migrate_to_unified",
+]
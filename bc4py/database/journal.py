@@ -0,0 +1,181 @@
+from bc4py.chain.utils import signature2bin, bin2signature
+from bc4py.chain.tx import TX
+from bc4py.chain.block import Block
+import struct
+import os
+import zlib
+import logging
+import threading
+
+
+# FILE: [magic 8s]-[version uint2]-[record]-[record]-...
+# RECORD: [payload_len uint4]-[crc32 uint4]-[payload]
+# PAYLOAD: [height uint4]-[flag uint1]-[inner_score double]-[work_hash 32s]-[header 80s]-[tx_len uint4]
+#          -([bin_len uint4]-[sign_len uint4]-[tx binary]-[signature binary])*tx_len
+JOURNAL_MAGIC = b'bc4pyJNL'
+JOURNAL_VERSION = 1
+struct_journal_header = struct.Struct('>8sH')
+struct_journal_record = struct.Struct('>II')
+struct_journal_block = struct.Struct('>IBd32s80sI')
+struct_journal_tx = struct.Struct('>II')
+
+
+def encode_block(block):
+    if block.work_hash is None:
+        block.update_pow()
+    b = struct_journal_block.pack(
+        block.height, block.flag, block.inner_score, block.work_hash, block.b, len(block.txs))
+    for tx in block.txs:
+        b_sign = signature2bin(tx.signature)
+        b += struct_journal_tx.pack(len(tx.b), len(b_sign)) + tx.b + b_sign
+    return b
+
+
+def decode_block(b):
+    height, flag, inner_score, work_hash, b_block, tx_len = struct_journal_block.unpack_from(b)
+    block = Block(binary=b_block)
+    block.height = height
+    block.flag = flag
+    block.inner_score = inner_score
+    block.work_hash = work_hash
+    pos = struct_journal_block.size
+    for dummy in range(tx_len):
+        bin_len, sign_len = struct_journal_tx.unpack_from(b, pos)
+        pos += struct_journal_tx.size
+        tx = TX(binary=b[pos:pos+bin_len])
+        tx.signature = bin2signature(b[pos+bin_len:pos+bin_len+sign_len])
+        pos += bin_len + sign_len
+        block.txs.append(tx)
+    assert pos == len(b), 'Wrong journal record size [{}={}]'.format(pos, len(b))
+    return block
+
+
+def _read_records(fp):
+    header = fp.read(struct_journal_header.size)
+    if len(header) == 0:
+        return
+    magic, version = struct_journal_header.unpack(header)
+    if magic != JOURNAL_MAGIC:
+        raise ValueError('Not a journal file.')
+    elif version != JOURNAL_VERSION:
+        raise ValueError('Unknown journal version {}.'.format(version))
+    while True:
+        b = fp.read(struct_journal_record.size)
+        if len(b) < struct_journal_record.size:
+            return
+        length, crc = struct_journal_record.unpack(b)
+        payload = fp.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            # torn tail, written when process killed
+            logging.warning("Ignore broken journal record.")
+            return
+        yield payload
+
+
+def _valid_length(path):
+    # end of the last valid record, torn tail is after it
+    pos = struct_journal_header.size
+    with open(path, mode='br') as fp:
+        for payload in _read_records(fp):
+            pos += struct_journal_record.size + len(payload)
+    return pos
+
+
+def _write_record(fp, payload):
+    fp.write(struct_journal_record.pack(len(payload), zlib.crc32(payload)) + payload)
+
+
+class Journal:
+    """ append only binary log of blocks on memory """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fp = None
+
+    def _open(self):
+        if self.fp is None:
+            f_new = not os.path.exists(self.path) or \
+                    os.path.getsize(self.path) < struct_journal_header.size
+            if f_new and os.path.exists(self.path):
+                os.remove(self.path)  # torn header
+            elif not f_new:
+                # cut torn tail, or appended records are never read
+                length = _valid_length(self.path)
+                if length < os.path.getsize(self.path):
+                    logging.warning("Cut broken journal tail {}bytes.".format(os.path.getsize(self.path) - length))
+                    with open(self.path, mode='r+b') as fp:
+                        fp.truncate(length)
+                        fp.flush()
+                        os.fsync(fp.fileno())
+            self.fp = open(self.path, mode='ab')
+            if f_new:
+                self.fp.write(struct_journal_header.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+
+    def close(self):
+        with self.lock:
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def append(self, block, sync=True):
+        payload = encode_block(block)
+        with self.lock:
+            self._open()
+            _write_record(self.fp, payload)
+            self.fp.flush()
+            if sync:
+                os.fsync(self.fp.fileno())
+
+    def read_iter(self):
+        # stream blocks in written order
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, mode='br') as fp:
+            for payload in _read_records(fp):
+                yield decode_block(payload)
+
+    def rewrite(self, check):
+        # keep records only check(height) is True
+        tmp_path = self.path + '.tmp'
+        with self.lock:
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+            count = 0
+            with open(tmp_path, mode='bw') as new_fp:
+                new_fp.write(struct_journal_header.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+                if os.path.exists(self.path):
+                    with open(self.path, mode='br') as old_fp:
+                        for payload in _read_records(old_fp):
+                            height = struct_journal_block.unpack_from(payload)[0]
+                            if check(height):
+                                _write_record(new_fp, payload)
+                                count += 1
+                new_fp.flush()
+                os.fsync(new_fp.fileno())
+            os.replace(tmp_path, self.path)
+        logging.debug("Rewrite journal, {} blocks left.".format(count))
+
+    def truncate(self, height):
+        # remove blocks already written to database
+        self.rewrite(check=lambda x: height < x)
+
+    def write_blocks(self, blocks):
+        with self.lock:
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        for block in blocks:
+            self.append(block)
+
+
+__all__ = [
+    "JOURNAL_VERSION",
+    "Journal",
+]
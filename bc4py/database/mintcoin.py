@@ -93,20 +93,21 @@ def decode(b):
     return bjson.loads(b)
 
 
-def fill_mintcoin_status(m, best_block=None, best_chain=None, stop_txhash=None):
+def fill_mintcoin_status(m, best_block=None, best_chain=None, stop_txhash=None, snapshot=None):
     assert m.version == -1, 'Already updated'
+    chain = snapshot or builder  # ChainSnapshot for readers
     # database
-    for index, txhash, params, setting in builder.db.read_coins_iter(coin_id=m.coin_id):
+    for index, txhash, params, setting in chain.db.read_coins_iter(coin_id=m.coin_id):
         if txhash == stop_txhash:
             return
         m.update(params=params, setting=setting, txhash=txhash)
     # memory
     if best_chain:
         _best_chain = None
-    elif best_block and best_block == builder.best_block:
-        _best_chain = builder.best_chain
+    elif best_block and best_block == chain.best_block:
+        _best_chain = chain.best_chain
     else:
-        dummy, _best_chain = builder.get_best_chain(best_block=best_block)
+        dummy, _best_chain = chain.get_best_chain(best_block=best_block)
     for block in reversed(best_chain or _best_chain):
         for tx in block.txs:
             if tx.hash == stop_txhash:
@@ -130,7 +131,7 @@ def fill_mintcoin_status(m, best_block=None, best_chain=None, stop_txhash=None):
             m.update(params=params, setting=setting, txhash=tx.hash)
 
 
-def get_mintcoin_object(coin_id, best_block=None, best_chain=None, stop_txhash=None):
+def get_mintcoin_object(coin_id, best_block=None, best_chain=None, stop_txhash=None, snapshot=None):
     if best_block:
         key = (best_block.hash, stop_txhash)
         if key in cashe:
@@ -138,7 +139,7 @@ def get_mintcoin_object(coin_id, best_block=None, best_chain=None, stop_txhash=N
     else:
         key = None
     m = MintCoin(coin_id=coin_id)
-    fill_mintcoin_status(m=m, best_block=best_block, best_chain=best_chain, stop_txhash=stop_txhash)
+    fill_mintcoin_status(m=m, best_block=best_block, best_chain=best_chain, stop_txhash=stop_txhash, snapshot=snapshot)
     if coin_id == 0:
         m.update(
             params=C.BASE_CURRENCY,
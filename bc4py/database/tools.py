@@ -6,6 +6,7 @@ from bc4py.database.account import read_pooled_address_iter
 
 best_block_cashe = None
 best_chain_cashe = None
+chain_hashes_cashe = (None, None, None)
 
 
 def _get_best_chain_all(best_block):
@@ -26,22 +27,34 @@ def _get_best_chain_all(best_block):
         return best_chain
 
 
+def _get_chain_hashes(best_chain):
+    global chain_hashes_cashe
+    # best_chainに含まれるBlockHashと、builder.spent_indexに無いBlock
+    if len(best_chain) == 0:
+        return frozenset(), list()
+    key = (best_chain[0].hash, len(best_chain))
+    if chain_hashes_cashe[0] == key:
+        return chain_hashes_cashe[1:]
+    chain_hashes = frozenset(block.hash for block in best_chain)
+    extra_blocks = [block for block in best_chain if builder.chain.get(block.hash) is not block]
+    chain_hashes_cashe = (key, chain_hashes, extra_blocks)
+    return chain_hashes, extra_blocks
+
+
 def get_utxo_iter(target_address, best_block=None, best_chain=None):
     assert isinstance(target_address, set), 'TargetAddress is set.'
     best_chain = best_chain or _get_best_chain_all(best_block)
     allow_mined_height = best_chain[0].height - C.MATURE_HEIGHT
     # DataBaseより
     for address in target_address:
-        for dummy, txhash, txindex, coin_id, amount, f_used in builder.db.read_address_idx_iter(address):
-            if f_used is False:
-                if txindex in get_usedindex(txhash=txhash, best_block=best_block, best_chain=best_chain):
-                    continue  # Used
-                tx = tx_builder.get_tx(txhash)
-                if tx.type in (C.TX_POW_REWARD, C.TX_POS_REWARD):
-                    if tx.height is not None and tx.height < allow_mined_height:
-                        yield address, tx.height, txhash, txindex, coin_id, amount
-                else:
-                    yield address, tx.height, txhash, txindex, coin_id, amount
+        for txhash, txindex, coin_id, amount, height, tx_type in builder.db.read_utxo_iter(address):
+            if txindex in get_usedindex(txhash=txhash, best_block=best_block, best_chain=best_chain):
+                continue  # Used
+            if tx_type in (C.TX_POW_REWARD, C.TX_POS_REWARD):
+                if height < allow_mined_height:
+                    yield address, height, txhash, txindex, coin_id, amount
+            else:
+                yield address, height, txhash, txindex, coin_id, amount
     # Memoryより
     for block in reversed(best_chain):
         for tx in block.txs:
@@ -80,9 +93,16 @@ def get_unspents_iter(outer_cur=None, best_chain=None):
 def get_usedindex(txhash, best_block=None, best_chain=None):
     assert builder.best_block, 'Not DataBase init.'
     best_chain = best_chain or _get_best_chain_all(best_block)
+    chain_hashes, extra_blocks = _get_chain_hashes(best_chain)
+    except_hash = best_block.hash if best_block else None
     # Memoryより
     usedindex = set()
-    for block in best_chain:
+    for _txindex, spenders in list(builder.spent_index.get(txhash, dict()).items()):
+        for blockhash in list(spenders):
+            if blockhash in chain_hashes and blockhash != except_hash:
+                usedindex.add(_txindex)
+                break
+    for block in extra_blocks:
         if best_block and block == best_block:
             continue
         for tx in block.txs:
@@ -93,18 +113,20 @@ def get_usedindex(txhash, best_block=None, best_chain=None):
     usedindex.update(builder.db.read_usedindex(txhash))
     # unconfirmedより
     if best_block is None:
-        for tx in list(tx_builder.unconfirmed.values()):
-            for _txhash, _txindex in tx.inputs:
-                if _txhash == txhash:
-                    usedindex.add(_txindex)
+        usedindex.update(list(tx_builder.unconfirmed.spent.get(txhash, dict())))
     return usedindex
 
 
 def is_usedindex(txhash, txindex, except_txhash, best_block=None, best_chain=None):
     assert builder.best_block, 'Not DataBase init.'
     best_chain = best_chain or _get_best_chain_all(best_block)
+    chain_hashes, extra_blocks = _get_chain_hashes(best_chain)
     # Memoryより
-    for block in best_chain:
+    spenders = builder.spent_index.get(txhash, dict()).get(txindex, dict())
+    for blockhash, spender in list(spenders.items()):
+        if blockhash in chain_hashes and spender != except_txhash:
+            return True
+    for block in extra_blocks:
         for tx in block.txs:
             if tx.hash == except_txhash:
                 continue
@@ -116,12 +138,9 @@ def is_usedindex(txhash, txindex, except_txhash, best_block=None, best_chain=Non
         return True
     # unconfirmedより
     if best_block is None:
-        for tx in tx_builder.unconfirmed.values():
-            if tx.hash == except_txhash:
-                continue
-            for _txhash, _txindex in tx.inputs:
-                if _txhash == txhash and _txindex == txindex:
-                    return True
+        spenders = tx_builder.unconfirmed.spent.get(txhash, dict()).get(txindex, set())
+        if len(spenders - {except_txhash}) > 0:
+            return True
     return False
 
 
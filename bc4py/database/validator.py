@@ -59,20 +59,21 @@ def encode(*args):
     return bjson.dumps(args, compress=False)
 
 
-def validator_fill(v: Validator, best_block=None, best_chain=None, stop_txhash=None):
+def validator_fill(v: Validator, best_block=None, best_chain=None, stop_txhash=None, snapshot=None):
     assert v.index == -1, 'Already updated'
+    chain = snapshot or builder  # ChainSnapshot for readers
     # database
-    for index, address, flag, txhash, sig_diff in builder.db.read_validator_iter(c_address=v.c_address):
+    for index, address, flag, txhash, sig_diff in chain.db.read_validator_iter(c_address=v.c_address):
         if txhash == stop_txhash:
             return
         v.update(flag=flag, address=address, sig_diff=sig_diff, txhash=txhash)
     # memory
     if best_chain:
         _best_chain = None
-    elif best_block and best_block == builder.best_block:
-        _best_chain = builder.best_chain
+    elif best_block and best_block == chain.best_block:
+        _best_chain = chain.best_chain
     else:
-        dummy, _best_chain = builder.get_best_chain(best_block=best_block)
+        dummy, _best_chain = chain.get_best_chain(best_block=best_block)
     for block in reversed(best_chain or _best_chain):
         for tx in block.txs:
             if tx.hash == stop_txhash:
@@ -96,7 +97,7 @@ def validator_fill(v: Validator, best_block=None, best_chain=None, stop_txhash=N
             v.update(flag=flag, address=address, sig_diff=sig_diff, txhash=tx.hash)
 
 
-def get_validator_object(c_address, best_block=None, best_chain=None, stop_txhash=None):
+def get_validator_object(c_address, best_block=None, best_chain=None, stop_txhash=None, snapshot=None):
     if best_block:
         key = (best_block.hash, stop_txhash)
         if key in cashe:
@@ -104,7 +105,7 @@ def get_validator_object(c_address, best_block=None, best_chain=None, stop_txhas
     else:
         key = None
     v = Validator(c_address=c_address)
-    validator_fill(v=v, best_block=best_block, best_chain=best_chain, stop_txhash=stop_txhash)
+    validator_fill(v=v, best_block=best_block, best_chain=best_chain, stop_txhash=stop_txhash, snapshot=snapshot)
     if key:
         cashe[key] = v
     return v
@@ -0,0 +1,243 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+
+from bc4py.chain.tx import TX
+from bc4py.chain.block import Block
+from binascii import hexlify
+from multiprocessing import get_context
+from collections import deque
+import logging
+import time
+import sys
+import os
+
+# LevelDB is locked by one process, so main process only reads raw bytes
+# in sorted batches and worker processes decode and check them.
+# 1. _check_chunk: blocks and txs => claims about address_index/used_index rows
+# 2. _check_claims: claims with rows read by main process
+
+
+def _check_chunk(args):
+    # worker process
+    previous_hash, blocks = args
+    claims = list()
+    for height, blockhash, header, b_height, txs in blocks:
+        block = Block(binary=header)
+        if block.hash != blockhash:
+            return height, "BlockHash don't match header [{}]".format(hexlify(blockhash).decode()), claims
+        elif block.previous_hash != previous_hash:
+            return height, "PreviousHash != BlockHash [{}!={}]".format(
+                hexlify(block.previous_hash).decode(), hexlify(previous_hash).decode()), claims
+        elif b_height != height:
+            return height, "BlockHeight != DBHeight [{}!={}]".format(b_height, height), claims
+        for txhash, tx_height, b_tx, usedindex in txs:
+            if b_tx is None:
+                return height, "Not found tx {}".format(hexlify(txhash).decode()), claims
+            tx = TX(binary=b_tx)
+            if tx.hash != txhash:
+                return height, "TXHash don't match binary [{}]".format(hexlify(txhash).decode()), claims
+            elif tx_height != height:
+                return height, "TXHeight != BlockHeight [{}!={}]".format(tx_height, height), claims
+            for txindex in usedindex:
+                if txindex >= len(tx.outputs):
+                    return height, "Too large usedindex {}:{}".format(hexlify(txhash).decode(), txindex), claims
+            # outputs => address index
+            for index, (address, coin_id, amount) in enumerate(tx.outputs):
+                claims.append((height, address, txhash, index, coin_id, amount, index in usedindex))
+            # inputs => used index
+            for input_hash, input_index in tx.inputs:
+                claims.append((height, None, input_hash, input_index, None, None, True))
+        previous_hash = blockhash
+    return None, None, claims
+
+
+def _check_claims(args):
+    # worker process, return first bad height and message
+    claims, usedindex, address_idx, exist_txs, f_pruned, full_address_index = args
+    for height, address, txhash, index, coin_id, amount, f_used in claims:
+        if address is None:
+            # input
+            if index not in usedindex.get(txhash, b''):
+                if f_pruned and txhash not in exist_txs:
+                    continue  # all spent and pruned
+                return height, "Already used but unused. [{}:{}]".format(hexlify(txhash).decode(), index)
+            continue
+        row = address_idx.get((address, txhash, index))
+        if row is None:
+            if full_address_index:
+                return height, "Not found address index {} {}:{}".format(
+                    address, hexlify(txhash).decode(), index)
+            continue
+        _coin_id, _amount, _f_used = row
+        if coin_id != _coin_id or amount != _amount:
+            return height, "Outputs, coin_id != _coin_id or amount != _amount [{}!={}] [{}!={}]"\
+                .format(coin_id, _coin_id, amount, _amount)
+        elif f_used and not _f_used:
+            return height, "Already used but unused flag. [{}:{}]".format(hexlify(txhash).decode(), index)
+    return None, None
+
+
+class Verifier:
+    def __init__(self, db, processes=None, chunk_size=200, full_address_index=True):
+        self.db = db
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.full_address_index = full_address_index
+        self.pruned_height = db.read_pruned_height()
+        self.checked_height = None
+        self.bad_height = None
+        self.message = None
+
+    def _read_chunks(self, start_height, stop_height):
+        from bc4py.database.builder import struct_block, struct_tx
+        previous_hash = self.db.read_block_hash(start_height - 1) if start_height > 0 else b'\xff' * 32
+        index = list()
+        for height, blockhash in self.db.read_block_hash_iter(start_height=start_height):
+            if stop_height is not None and stop_height <= height:
+                break
+            index.append((height, blockhash))
+            if len(index) < self.chunk_size:
+                continue
+            yield self._read_chunk(previous_hash, index, struct_block, struct_tx)
+            previous_hash = index[-1][1]
+            index = list()
+        if len(index) > 0:
+            yield self._read_chunk(previous_hash, index, struct_block, struct_tx)
+
+    def _read_chunk(self, previous_hash, index, struct_block, struct_tx):
+        b_blocks = self.db._read_many('_block', [blockhash for height, blockhash in index])
+        blocks = list()
+        txhashes = list()
+        for height, blockhash in index:
+            b = b_blocks.get(blockhash)
+            if b is None:
+                # check by worker as wrong hash
+                blocks.append((height, blockhash, b'\x00' * 80, height, list()))
+                continue
+            b_height, _time, work, header, flag, tx_len = struct_block.unpack_from(b)
+            idx = struct_block.size
+            block_txhashes = [b[idx+32*i:idx+32*i+32] for i in range(tx_len//32)]
+            txhashes.extend(block_txhashes)
+            blocks.append((height, blockhash, header, b_height, block_txhashes))
+        b_txs = self.db._read_many('_tx', txhashes)
+        b_usedindex = self.db._read_many('_used_index', txhashes)
+        chunk = list()
+        for height, blockhash, header, b_height, block_txhashes in blocks:
+            txs = list()
+            for txhash in block_txhashes:
+                b = b_txs.get(txhash)
+                if b is None:
+                    txs.append((txhash, None, None, b''))
+                    continue
+                tx_height, _time, bin_len, sign_len = struct_tx.unpack_from(b)
+                txs.append((txhash, tx_height, bytes(b[16:16+bin_len]), b_usedindex.get(txhash, b'')))
+            chunk.append((height, blockhash, header, b_height, txs))
+        return previous_hash, chunk
+
+    def _read_claim_rows(self, claims):
+        # rows of claims by sorted batch reads
+        from bc4py.database.builder import struct_address_idx, ITER_ORDER
+        input_hashes = set()
+        address_keys = dict()
+        for height, address, txhash, index, coin_id, amount, f_used in claims:
+            if address is None:
+                input_hashes.add(txhash)
+            else:
+                k = address.encode() + txhash + index.to_bytes(1, ITER_ORDER)
+                address_keys[k] = (address, txhash, index)
+        usedindex = {k: bytes(v) for k, v in self.db._read_many('_used_index', input_hashes).items()}
+        address_idx = {address_keys[k]: struct_address_idx.unpack(v)
+                       for k, v in self.db._read_many('_address_index', address_keys).items()}
+        exist_txs = set()
+        if self.pruned_height is not None:
+            missing = {txhash for height, address, txhash, index, coin_id, amount, f_used in claims
+                       if address is None and index not in usedindex.get(txhash, b'')}
+            exist_txs.update(self.db._read_many('_tx', missing))
+        return usedindex, address_idx, exist_txs
+
+    def _throw_claims(self, pool, parsing, checking):
+        bad_height, message, claims = parsing.popleft().get()
+        usedindex, address_idx, exist_txs = self._read_claim_rows(claims)
+        args = (claims, usedindex, address_idx, exist_txs, self.pruned_height is not None, self.full_address_index)
+        last_height = claims[-1][0] if len(claims) > 0 else None
+        checking.append((pool.apply_async(_check_claims, (args,)), bad_height, message, last_height))
+
+    def _collect_claims(self, checking):
+        # return True if found inconsistency
+        async_result, bad_height, message, last_height = checking.popleft()
+        claim_height, claim_message = async_result.get()
+        if claim_height is not None:
+            # claims before bad height are checked too
+            bad_height, message = claim_height, claim_message
+        if bad_height is not None:
+            self.bad_height, self.message = bad_height, message
+            logging.error("Found inconsistency at {} height, {}".format(bad_height, message))
+            return True
+        if last_height is not None:
+            self.checked_height = last_height
+        return False
+
+    def run(self, start_height=0, stop_height=None):
+        if self.pruned_height is not None and start_height <= self.pruned_height:
+            start_height = self.pruned_height + 1
+            logging.info("Pruned database, verify from {} height.".format(start_height))
+        t = time.time()
+        # tasks are thrown by main thread, pool's feeder thread never blocked
+        max_pending = self.processes * 2
+        parsing = deque()  # [AsyncResult of _check_chunk,..]
+        checking = deque()  # [(AsyncResult of _check_claims, bad_height, message, last_height),..]
+        count = 0
+        with get_context('spawn').Pool(processes=self.processes) as pool:
+            chunks = self._read_chunks(start_height, stop_height)
+            try:
+                for chunk in chunks:
+                    parsing.append(pool.apply_async(_check_chunk, (chunk,)))
+                    while len(parsing) > 0 and (parsing[0].ready() or max_pending <= len(parsing)):
+                        self._throw_claims(pool, parsing, checking)
+                    while len(checking) > 0 and (checking[0][0].ready() or max_pending <= len(checking)):
+                        if self._collect_claims(checking):
+                            pool.terminate()
+                            return self.bad_height
+                        count += 1
+                        logging.info("Verified {} chunks, {} height, {}Sec"
+                                     .format(count, self.checked_height, round(time.time()-t, 1)))
+                while len(parsing) > 0:
+                    self._throw_claims(pool, parsing, checking)
+                while len(checking) > 0:
+                    if self._collect_claims(checking):
+                        pool.terminate()
+                        return self.bad_height
+                    count += 1
+            finally:
+                chunks.close()
+        logging.info("Finish verify database, no inconsistency. {}Sec".format(round(time.time()-t, 1)))
+        return None
+
+
+def verify_database(db, start_height=0, stop_height=None, processes=None, chunk_size=200):
+    # return first inconsistent height or None
+    from bc4py.database.builder import config
+    verifier = Verifier(db, processes=processes, chunk_size=chunk_size,
+                        full_address_index=config['full_address_index'])
+    return verifier.run(start_height=start_height, stop_height=stop_height)
+
+
+if __name__ == '__main__':
+    # python -m bc4py.database.verify [sub_dir]
+    from bc4py.config import V
+    from bc4py.utils import set_database_path
+    from bc4py.database.builder import DataBase
+    logging.basicConfig(level=logging.INFO)
+    set_database_path(sub_dir=sys.argv[1] if len(sys.argv) > 1 else None)
+    database = DataBase(os.path.join(V.DB_HOME_DIR, 'db'))
+    try:
+        result = verify_database(database)
+    finally:
+        database.close()
+    exit(0 if result is None else 1)
+
+
+__all__ = [
+    "Verifier",
+    "verify_database",
+]
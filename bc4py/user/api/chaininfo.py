@@ -10,10 +10,13 @@ from base64 import b64encode
 async def get_block_by_height(request):
     f_pickled = request.query.get('pickle', False)
     height = int(request.query.get('height', 0))
-    blockhash = builder.get_block_hash(height)
-    if blockhash is None:
-        return web.Response(text="Not found height.", status=400)
-    block = builder.get_block(blockhash)
+    with builder.snapshot() as snapshot:
+        blockhash = snapshot.get_block_hash(height)
+        if blockhash is None:
+            return web.Response(text="Not found height.", status=400)
+        block = snapshot.get_block(blockhash)
+    if block is None:
+        return web.Response(text="Not found block.", status=400)
     if f_pickled:
         block = pickle.dumps(block)
         return web.Response(text=b64encode(block).decode())
@@ -28,7 +31,8 @@ async def get_block_by_hash(request):
         f_pickled = request.query.get('pickle', False)
         blockhash = request.query.get('hash')
         blockhash = unhexlify(blockhash.encode())
-        block = builder.get_block(blockhash)
+        with builder.snapshot() as snapshot:
+            block = snapshot.get_block(blockhash)
         if block is None:
             return web.Response(text="Not found block.", status=400)
         if f_pickled:
@@ -66,7 +70,8 @@ async def get_tx_by_hash(request):
 async def get_mintcoin_info(request):
     try:
         mint_id = int(request.query.get('mint_id', 0))
-        m = get_mintcoin_object(coin_id=mint_id)
+        with builder.snapshot() as snapshot:
+            m = get_mintcoin_object(coin_id=mint_id, snapshot=snapshot)
         return web_base.json_res(m.info)
     except BaseException:
         return web_base.error_res()
@@ -76,12 +81,13 @@ async def get_mintcoin_history(request):
     try:
         mint_id = int(request.query.get('mint_id', 0))
         data = list()
-        for index, txhash, params, setting in builder.db.read_coins_iter(coin_id=mint_id):
-            data.append({
-                'index': index,
-                'txhash': hexlify(txhash).decode(),
-                'params': params,
-                'setting': setting})
+        with builder.snapshot() as snapshot:
+            for index, txhash, params, setting in snapshot.db.read_coins_iter(coin_id=mint_id):
+                data.append({
+                    'index': index,
+                    'txhash': hexlify(txhash).decode(),
+                    'params': params,
+                    'setting': setting})
         return web_base.json_res(data)
     except BaseException:
         return web_base.error_res()
@@ -4,18 +4,22 @@ from bc4py.chain.utils import GompertzCurve
 from bc4py.chain.difficulty import get_bits_by_hash, get_bias_by_hash
 from bc4py.database.create import closing, create_db
 from bc4py.database.builder import builder, tx_builder
+from bc4py.database.engine import database_tuple
 from bc4py.database.keylock import is_locked_database
 # from bc4py.database.tools import get_validator_info
 # from bc4py.user.utils import im_a_validator
 from bc4py.user.api import web_base
 from bc4py.user.generate import generating_threads
 from binascii import hexlify
+import threading
+import logging
 import time
 import p2p_python
 
 
 MAX_256_INT = 0xffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff
 start_time = int(time.time())
+compaction_thread = None
 
 __api_version__ = '0.0.2'
 
@@ -73,6 +77,8 @@ async def system_private_info(request):
             'booting': P.F_NOW_BOOTING,
             'connections': len(V.PC_OBJ.p2p.user),
             'unconfirmed': [hexlify(txhash).decode() for txhash in tx_builder.unconfirmed.keys()],
+            'tx_cashe': tx_builder.cashe.info,
+            'bloom_filter': builder.db.bloom_info,
             'directory': V.DB_HOME_DIR,
             'encryption': '*'*len(V.ENCRYPT_KEY) if V.ENCRYPT_KEY else V.ENCRYPT_KEY,
             'generate': {
@@ -103,9 +109,44 @@ async def network_info(request):
         return web_base.error_res()
 
 
+async def database_stats(request):
+    try:
+        count_keys = bool(request.query.get('keys', False))
+        data = builder.db.stats(count_keys=count_keys)
+        data['compacting'] = bool(compaction_thread and compaction_thread.is_alive())
+        return web_base.json_res(data)
+    except BaseException:
+        return web_base.error_res()
+
+
+async def database_compact(request):
+    global compaction_thread
+    post = await web_base.content_type_json_check(request)
+    try:
+        table = post.get('table') if post else None
+        if table is not None and table not in database_tuple:
+            return web_base.error_res('Unknown table "{}".'.format(table))
+        if compaction_thread and compaction_thread.is_alive():
+            return web_base.error_res('Already compacting.')
+
+        def compact():
+            try:
+                builder.db.compact(name=table)
+            except BaseException as e:
+                logging.error("Failed compaction, {}".format(e), exc_info=True)
+
+        compaction_thread = threading.Thread(target=compact, name='Compaction', daemon=True)
+        compaction_thread.start()
+        return web_base.json_res({'table': table, 'start_time': int(time.time())})
+    except BaseException:
+        return web_base.error_res()
+
+
 __all__ = [
     "chain_info",
     "system_info",
     "system_private_info",
     "network_info",
+    "database_stats",
+    "database_compact",
 ]
@@ -79,6 +79,8 @@ def create_rest_server(f_local, port=3000, user=None, pwd=None, f_blocking=True,
     app.router.add_get('/public/getnetworkinfo', network_info)
     app.router.add_get('/private/resync', resync)
     app.router.add_get('/private/stop', close_server)
+    app.router.add_get('/private/dbstats', database_stats)
+    app.router.add_post('/private/dbcompact', database_compact)
     # Account
     app.router.add_get('/private/listbalance', list_balance)
     app.router.add_get('/private/listtransactions', list_transactions)
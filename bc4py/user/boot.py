@@ -54,8 +54,7 @@ def load_boot_file():
 def create_bootstrap_file():
     boot_path = os.path.join(V.DB_HOME_DIR, 'bootstrap.dat')
     with open(boot_path, mode='ba') as fp:
-        for height, blockhash in builder.db.read_block_hash_iter(start_height=0):
-            block = builder.db.read_block(blockhash)
+        for height, block in builder.db.read_blocks_range(start_height=0):
             fp.write(b64encode(pickle.dumps(block))+b'\n')
     logging.info("create new bootstrap.dat!")
 
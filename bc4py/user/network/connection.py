@@ -8,6 +8,7 @@ import time
 
 good_node = list()
 bad_node = list()
+pruned_node = dict()  # {user: pruned_height}
 best_hash_on_network = None
 best_height_on_network = None
 
@@ -28,6 +29,10 @@ def set_good_node():
         blockhash[r['hash']] += 1
         blockheight[r['height']] += 1
         _node.append((_user, r['hash'], r['height'], r['booting']))
+        if r.get('pruned') is not None:
+            pruned_node[_user] = r['pruned']
+        elif _user in pruned_node:
+            del pruned_node[_user]
     global best_hash_on_network, best_height_on_network
     best_hash_on_network, num0 = blockhash.most_common()[0]
     best_height_on_network, num1 = blockheight.most_common()[0]
@@ -64,6 +69,8 @@ def ask_node(cmd, data=None, f_continue_asking=False):
             if user in bad_node:
                 count -= 1
                 continue
+            elif cmd == DirectCmd.BIG_BLOCKS and data['height'] <= pruned_node.get(user, -1):
+                continue  # pruned node don't have old blocks
             elif user not in good_node:
                 set_good_node()
                 if len(good_node) == 0:
@@ -13,7 +13,8 @@ def _best_info():
             'flag': builder.best_block.flag,
             'difficulty': builder.best_block.difficulty,
             'txs': txs,
-            'booting': P.F_NOW_BOOTING}
+            'booting': P.F_NOW_BOOTING,
+            'pruned': builder.db.read_pruned_height()}
     else:
         return {
             'hash': None,
@@ -22,7 +23,8 @@ def _best_info():
             'flag': None,
             'difficulty': None,
             'txs': [],
-            'booting': True}
+            'booting': True,
+            'pruned': None}
 
 
 def _block_by_height(height):
@@ -72,8 +74,19 @@ def _unconfirmed_tx():
 
 
 def _big_blocks(height):
+    pruned_height = builder.db.read_pruned_height()
+    if pruned_height is not None and height <= pruned_height:
+        return 'Pruned node, cannot serve blocks lower than {} height.'.format(pruned_height + 1)
     data = list()
-    for i in range(20):
+    # DataBaseより
+    root_height = builder.root_block.height if builder.root_block else None
+    if root_height is not None and 0 <= height <= root_height:
+        stop_height = min(height + 20, root_height + 1)
+        for dummy, block in builder.db.read_blocks_range(start_height=height, stop_height=stop_height):
+            txs = [(tx.b, tx.signature) for tx in block.txs]
+            data.append((block.b, block.height, block.flag, txs))
+    # Memoryより
+    for i in range(len(data), 20):
         blockhash = builder.get_block_hash(height + i)
         if blockhash is None:
             break
@@ -1,7 +1,7 @@
 from bc4py.config import C, V, P, BlockChainError
 from bc4py.chain.block import Block
 from bc4py.chain.tx import TX
-from bc4py.chain.checking import check_block, check_tx, check_tx_time
+from bc4py.chain.checking import check_block, check_tx, check_tx_time, BlockContext
 from bc4py.chain.checking.signature import batch_sign_cashe
 from bc4py.chain.workhash import get_workhash_fnc
 from bc4py.database.builder import builder, tx_builder, user_account
@@ -10,7 +10,7 @@ from bc4py.user.network import update_mining_staking_all_info
 from bc4py.user.network.directcmd import DirectCmd
 from bc4py.user.network.connection import *
 from bc4py.user.exit import system_exit
-from pooled_multiprocessing import mp_map_async, Waiter
+from pooled_multiprocessing import mp_map_async
 import logging
 from time import time, sleep
 from threading import Thread, Lock
@@ -23,41 +23,107 @@ block_stack = dict()
 backend_processing_lock = Lock()
 write_protect_lock = Lock()
 
+# pipeline: download => stateless check on pool => stateful check and commit
+MAX_STACK_BLOCKS = 400  # queue depth of downloaded blocks
+STATELESS_TIMEOUT = 60  # Sec, pool task lost when process dead
+stateless_waiter = dict()  # {blockhash: Waiter}
+stage_stats = {
+    'download': [0, 0.0],  # [blocks, Sec]
+    'stateless': [0, 0.0],
+    'stateful': [0, 0.0]}
+POW_FLAGS = (C.BLOCK_YES_POW, C.BLOCK_HMQ_POW, C.BLOCK_X11_POW, C.BLOCK_LTC_POW, C.BLOCK_X16R_POW)
 
-def _generate_workhash(height, block_flag, block_b, **kwargs):
-    # TODO: warning, check memory leak
-    return height, get_workhash_fnc(block_flag)(block_b)
 
+def _stateless_check(blockhash, block_flag, block_b, txs, **kwargs):
+    # on process pool, check without chain state
+    s = time()
+    work_hash = None
+    try:
+        block = Block(binary=block_b)
+        block.flag = block_flag
+        for tx_b, tx_signature in txs:
+            tx = TX(binary=tx_b)
+            tx.signature = tx_signature
+            block.txs.append(tx)
+        if len(block.txs) == 0:
+            raise BlockChainError('Block don\'t have any txs.')
+        elif block.getsize() > C.SIZE_BLOCK_LIMIT:
+            raise BlockChainError('Block size is too large [{}b>{}b]'.format(block.getsize(), C.SIZE_BLOCK_LIMIT))
+        if block_flag in POW_FLAGS:
+            work_hash = get_workhash_fnc(block_flag)(block_b)
+            block.work_hash = work_hash
+            if not block.pow_check():
+                raise BlockChainError('Not correct work hash {}'.format(block))
+        merkleroot = block.merkleroot
+        block.update_merkleroot()
+        if merkleroot != block.merkleroot:
+            raise BlockChainError('Not correct merkleroot {}'.format(block))
+        error = None
+    except Exception as e:
+        error = str(e)
+    return blockhash, work_hash, error, time() - s
 
-def _callback_workhash(data_list):
+
+def _callback_stateless(data_list):
     if isinstance(data_list[0], str):
-        logging.error("error on callback_workhash(), {}".format(data_list[0]))
+        logging.error("error on callback_stateless(), {}".format(data_list[0]))
         return
-    block_stack_copy = block_stack.copy()
-    for height, workhash in data_list:
-        if height in block_stack_copy:
-            block_stack_copy[height].work_hash = workhash
-    logging.debug("callback_workhash() workhash={}".format(len(data_list)))
+    for blockhash, work_hash, error, spend in data_list:
+        stage_stats['stateless'][0] += 1
+        stage_stats['stateless'][1] += spend
+    logging.debug("callback_stateless() checked={}".format(len(data_list)))
 
 
-def batch_workhash(blocks):
+def batch_stateless_check(blocks, txs_list):
     data_list = list()
-    s = time()
+    for block, txs in zip(blocks, txs_list):
+        data_list.append((block.hash, block.flag, block.b, txs))
+    waiter, result = mp_map_async(_stateless_check, data_list, callback=_callback_stateless)
     for block in blocks:
-        if block.flag in (C.BLOCK_YES_POW, C.BLOCK_HMQ_POW, C.BLOCK_X11_POW, C.BLOCK_LTC_POW, C.BLOCK_X16R_POW):
-            data_list.append((block.height, block.flag, block.b))
-    if len(data_list) > 0:
-        waiter, result = mp_map_async(_generate_workhash, data_list, callback=_callback_workhash)
-        logging.debug("Success batch workhash {} by {}Sec".format(len(data_list), round(time()-s, 3)))
-        return waiter
-    else:
-        waiter = Waiter(0)
-        waiter.set()
-        return waiter
+        stateless_waiter[block.hash] = waiter
+    logging.debug("Put stateless check {} blocks.".format(len(data_list)))
 
 
-def put_to_block_stack(r, before_waiter):
+def wait_stateless_check(block):
+    # return error message or None, result of same blockhash only
+    waiter = stateless_waiter.pop(block.hash, None)
+    if waiter is None:
+        return 'Not throw stateless check {}.'.format(block)
+    if not waiter.wait(timeout=STATELESS_TIMEOUT):
+        return 'Timeout stateless check {}.'.format(block)
+    for data in waiter.result:
+        if isinstance(data, str):
+            continue  # error on pool
+        blockhash, work_hash, error, spend = data
+        if blockhash == block.hash:
+            if work_hash is not None:
+                block.work_hash = work_hash
+            return error
+    return 'Failed stateless check {}.'.format(block)
+
+
+def clear_block_stack(start_height):
+    with write_protect_lock:
+        for height in tuple(block_stack.keys()):
+            if height >= start_height:
+                del block_stack[height]
+        stacked = {block.hash for block in block_stack.values()}
+        for blockhash in tuple(stateless_waiter.keys()):
+            if blockhash not in stacked:
+                del stateless_waiter[blockhash]
+
+
+def stage_stats_info():
+    return {name: {
+        'blocks': blocks,
+        'time': round(spend, 3),
+        'blocks/s': round(blocks / spend, 2) if spend else None}
+        for name, (blocks, spend) in stage_stats.items()}
+
+
+def put_to_block_stack(r, download_time):
     block_tmp = dict()
+    txs_tmp = list()
     batch_txs = list()
     for block_b, block_height, block_flag, txs in r:
         block = Block(binary=block_b)
@@ -73,35 +139,37 @@ def put_to_block_stack(r, before_waiter):
             else:
                 block.txs.append(tx)
         block_tmp[block_height] = block
+        txs_tmp.append(txs)
         batch_txs.extend(block.txs)
     # check
     if len(block_tmp) == 0:
-        return None
-    batch_sign_cashe(batch_txs)
-    before_waiter.wait()
+        return False
+    stage_stats['download'][0] += len(block_tmp)
+    stage_stats['download'][1] += download_time
     with write_protect_lock:
         block_stack.update(block_tmp)
-    return batch_workhash(tuple(block_tmp.values()))
+    batch_sign_cashe(batch_txs)
+    batch_stateless_check(tuple(block_tmp.values()), txs_tmp)
+    return True
 
 
-def fill_block_stack(before_waiter):
+def fill_block_stack():
     if len(block_stack) == 0:
-        return None
+        return False
     height = max(block_stack) + 1
     logging.debug("Stack blocks on back form {}".format(height))
+    s = time()
     r = ask_node(cmd=DirectCmd.BIG_BLOCKS, data={'height': height}, f_continue_asking=True)
     if isinstance(r, str):
         logging.debug("NewBLockGetError:{}".format(r))
     elif isinstance(r, list):
-        return put_to_block_stack(r, before_waiter)
+        return put_to_block_stack(r, time() - s)
     else:
         logging.debug("Not correct format BIG_BLOCKS.")
-    return None
+    return False
 
 
 def background_sync_chain():
-    waiter = Waiter(0)
-    waiter.set()
     sleep_count = 500
     while True:
         if sleep_count < 0:
@@ -110,13 +178,13 @@ def background_sync_chain():
         if len(block_stack) == 0:
             sleep(0.1)
             sleep_count -= 1
-        elif 400 < len(block_stack):
+        elif MAX_STACK_BLOCKS < len(block_stack):
             sleep(0.1)
         else:
             sleep_count = 500
             with backend_processing_lock:
-                waiter = fill_block_stack(waiter)
-            if waiter is None:
+                f_continue = fill_block_stack()
+            if not f_continue:
                 logging.info("Close background_sync_chain() by finish.")
                 return
 
@@ -144,6 +212,7 @@ def fast_sync_chain():
         else:
             with backend_processing_lock:
                 logging.debug("Stack blocks on front form {}".format(index_height))
+                s = time()
                 r = ask_node(cmd=DirectCmd.BIG_BLOCKS, data={'height': index_height})
                 if isinstance(r, str):
                     logging.debug("NewBLockGetError:{}".format(r))
@@ -152,56 +221,46 @@ def fast_sync_chain():
                     failed_num += 1
                     continue
                 elif isinstance(r, list):
-                    waiter = Waiter(0)
-                    waiter.set()
-                    waiter = put_to_block_stack(r, waiter)
-                    if waiter is None or len(block_stack) == 0:
+                    if not put_to_block_stack(r, time() - s) or len(block_stack) == 0:
                         break
                     else:
-                        waiter.wait()
                         continue
                 else:
                     failed_num += 1
                     logging.debug("Not correct format BIG_BLOCKS.")
                     continue
         # Base check
-        base_check_failed_msg = None
+        base_check_failed_msg = wait_stateless_check(new_block)
+        s = time()
         if before_block.hash != new_block.previous_hash:
             base_check_failed_msg = "Not correct previous hash {}".format(new_block)
         # proof of work check
-        if not new_block.pow_check():
+        elif base_check_failed_msg is None and not new_block.pow_check():
             base_check_failed_msg = "Not correct work hash {}".format(new_block)
         # rollback
         if base_check_failed_msg is not None:
             before_block = builder.get_block(before_block.previous_hash)
             index_height = before_block.height + 1
             failed_num += 1
-            for height in tuple(block_stack.keys()):
-                if height >= index_height:
-                    del block_stack[height]
+            clear_block_stack(index_height)
             logging.debug(base_check_failed_msg)
             continue
-        # TX check
-        if len(new_block.txs) > 1:
-            with closing(create_db(V.DB_ACCOUNT_PATH)) as db:
-                cur = db.cursor()
-                for tx in new_block.txs:
-                    if tx.type in (C.TX_POS_REWARD, C.TX_POW_REWARD):
-                        continue
-                    check_tx(tx=tx, include_block=None)
-                    tx_builder.put_unconfirmed(tx=tx, outer_cur=cur)
-                db.commit()
-        # Block check
+        # Block check, 親Blockの状態に対して1度だけTXを検査
         check_block(new_block)
+        context = BlockContext(new_block)
         for tx in new_block.txs:
             tx.height = new_block.height
-            check_tx(tx=tx, include_block=new_block)
+            check_tx(tx=tx, include_block=new_block, context=context)
         # Chainに挿入
         builder.new_block(new_block)
-        for tx in new_block.txs:
-            user_account.affect_new_tx(tx)
+        with closing(create_db(V.DB_ACCOUNT_PATH)) as db:
+            cur = db.cursor()
+            for tx in new_block.txs:
+                user_account.affect_new_tx(tx, cur)
         builder.batch_apply()
         f_changed_status = True
+        stage_stats['stateful'][0] += 1
+        stage_stats['stateful'][1] += time() - s
         # 次のBlock
         failed_num = 0
         before_block = new_block
@@ -209,8 +268,10 @@ def fast_sync_chain():
         # ロギング
         if index_height % 100 == 0:
             logging.debug("Update block {} now...".format(index_height + 1))
+            logging.debug("Sync pipeline stacked={} checking={} {}".format(
+                len(block_stack), len(stateless_waiter), stage_stats_info()))
     # Unconfirmed txを取得
-    logging.info("Finish get block, next get unconfirmed.")
+    logging.info("Finish get block, next get unconfirmed. {}".format(stage_stats_info()))
     r = None
     while not isinstance(r, dict):
         r = ask_node(cmd=DirectCmd.UNCONFIRMED_TX, f_continue_asking=True)
@@ -9,6 +9,7 @@ from Cryptodome.Hash import SHA256
 from base64 import b64decode, b64encode
 import multiprocessing
 import os
+import sys
 import time
 import bjson
 import psutil
@@ -47,6 +48,16 @@ def set_blockchain_params(genesis_block):
     GompertzCurve.setup_params()
 
 
+def get_verify_depth(argv=None):
+    # --verify-db => all blocks, --verify-db=N => last N blocks, none => trust checkpoint
+    for arg in (argv or sys.argv[1:]):
+        if arg == '--verify-db' or arg == '--verify-db=full':
+            return None
+        elif arg.startswith('--verify-db='):
+            return int(arg[len('--verify-db='):])
+    return 0
+
+
 def delete_pid_file():
     # PIDファイルを削除
     pid_path = os.path.join(V.DB_HOME_DIR, 'pid.lock')
@@ -3,7 +3,7 @@
 
 from bc4py import __version__, __chain_version__, __message__, __logo__
 from bc4py.config import C, V, P
-from bc4py.utils import set_database_path, set_blockchain_params
+from bc4py.utils import set_database_path, set_blockchain_params, get_verify_depth
 from bc4py.user.generate import *
 from bc4py.user.boot import *
 from bc4py.user.network import *
@@ -21,7 +21,7 @@ from threading import Thread
 import logging
 
 
-def work(port, sub_dir=None):
+def work(port, sub_dir=None, verify_depth=0):
     # BlockChain setup
     set_database_path(sub_dir=sub_dir)
     builder.set_database_path()
@@ -53,7 +53,7 @@ def work(port, sub_dir=None):
     pc.broadcast_check = broadcast_check
 
     # Update to newest blockchain
-    builder.init(genesis_block, batch_size=500)
+    builder.init(genesis_block, batch_size=500, verify_depth=verify_depth)
     builder.db.sync = False  # more fast but unstable
     sync_chain_loop()
 
@@ -91,4 +91,4 @@ if __name__ == '__main__':
     set_logger(level=logging.DEBUG)
     logging.info("\n{}\n====\n{}, chain-ver={}\n{}\n"
                  .format(__logo__, __version__, __chain_version__, __message__))
-    work(port=2000)
+    work(port=2000, verify_depth=get_verify_depth())
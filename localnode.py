@@ -3,7 +3,7 @@
 
 from bc4py import __version__, __chain_version__, __message__, __logo__
 from bc4py.config import C, V, P
-from bc4py.utils import set_database_path, set_blockchain_params
+from bc4py.utils import set_database_path, set_blockchain_params, get_verify_depth
 # from bc4py.user.stratum import Stratum, start_stratum, close_stratum
 from bc4py.user.generate import *
 from bc4py.user.boot import *
@@ -36,7 +36,7 @@ def copy_boot(port):
             ofp.write(ifp.read())
 
 
-def work(port, sub_dir):
+def work(port, sub_dir, verify_depth=0):
     # BlockChain setup
     set_database_path(sub_dir=sub_dir)
     builder.set_database_path()
@@ -72,8 +72,9 @@ def work(port, sub_dir):
     pc.broadcast_check = broadcast_check
 
     # Update to newest blockchain
-    builder.init(genesis_block, batch_size=500)
+    builder.init(genesis_block, batch_size=500, verify_depth=verify_depth)
     # builder.db.sync = False  # more fast
+    # builder.db.write_behind = True  # write batch on background thread
     sync_chain_loop()
 
     # Mining/Staking setup
@@ -114,7 +115,7 @@ def work(port, sub_dir):
         logging.debug("KeyboardInterrupt.")
 
 
-def connection():
+def connection(verify_depth=0):
     port = 2000
     while True:
         if f_already_bind(port):
@@ -123,9 +124,9 @@ def connection():
         set_logger(level=logging.DEBUG, prefix=port)
         logging.info("\n{}\n=====\n{}, chain-ver={}\n{}\n"
                      .format(__logo__, __version__, __chain_version__, __message__))
-        work(port=port, sub_dir=str(port))
+        work(port=port, sub_dir=str(port), verify_depth=verify_depth)
         break
 
 
 if __name__ == '__main__':
-    connection()
+    connection(verify_depth=get_verify_depth())
@@ -0,0 +1,60 @@
+from bc4py.database.journal import Journal, _read_records, _write_record, \
+    struct_journal_block, struct_journal_record
+import tempfile
+import unittest
+import zlib
+import os
+
+
+def _payload(height):
+    return struct_journal_block.pack(height, 0, 0.0, b'\x00' * 32, b'\x00' * 80, 0)
+
+
+def _append(journal, height):
+    with journal.lock:
+        journal._open()
+        _write_record(journal.fp, _payload(height))
+        journal.fp.flush()
+
+
+def _heights(path):
+    with open(path, mode='br') as fp:
+        return [struct_journal_block.unpack_from(payload)[0] for payload in _read_records(fp)]
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.dirs = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dirs.name, 'journal.dat')
+
+    def tearDown(self):
+        self.dirs.cleanup()
+
+    def test_append_after_torn_tail(self):
+        journal = Journal(self.path)
+        for height in (1, 2, 3):
+            _append(journal, height)
+        journal.close()
+        # killed while writing 4th record
+        payload = _payload(4)
+        with open(self.path, mode='ab') as fp:
+            fp.write(struct_journal_record.pack(len(payload), zlib.crc32(payload)) + payload[:10])
+        journal = Journal(self.path)
+        for height in (4, 5):
+            _append(journal, height)
+        journal.close()
+        self.assertEqual(_heights(self.path), [1, 2, 3, 4, 5])
+        journal.truncate(1)
+        self.assertEqual(_heights(self.path), [2, 3, 4, 5])
+
+    def test_torn_header(self):
+        with open(self.path, mode='bw') as fp:
+            fp.write(b'bc4')
+        journal = Journal(self.path)
+        _append(journal, 1)
+        journal.close()
+        self.assertEqual(_heights(self.path), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+from bc4py.chain.checking.signature import _is_torsion_free, _multi_scalarmult, _batch_verify, _verify
+from nem_ed25519.utils import decodepoint, encodepoint, scalarmult, scalarmult_B, edwards_add, \
+    inverse, IDENT, PRIME, L
+from nem_ed25519.signature import sign
+from nem_ed25519.key import secret_key, public_key
+import unittest
+import random
+import os
+
+
+PREFIX = b'\x68'
+
+
+def _affine(P):
+    x, y, z, t = P
+    zi = inverse(z)
+    return x * zi % PRIME, y * zi % PRIME
+
+
+def _random_point():
+    while True:
+        try:
+            return decodepoint(os.urandom(32))
+        except Exception:
+            pass
+
+
+def _torsion_points():
+    # [0, T, 2T,.. 7T] of order 8 point T
+    while True:
+        T = scalarmult(_random_point(), L)
+        if _affine(scalarmult(T, 4)) != (0, 1):
+            break
+    points = [IDENT]
+    for i in range(7):
+        points.append(edwards_add(points[-1], T))
+    return points
+
+
+def _tasks(num):
+    tasks = list()
+    for i in range(num):
+        sk = secret_key()
+        pk = public_key(sk)
+        msg = os.urandom(64)
+        tasks.append((pk, sign(msg, sk, pk), os.urandom(32), msg))
+    return tasks
+
+
+class TestSignature(unittest.TestCase):
+    def test_torsion_free(self):
+        torsion = _torsion_points()
+        for i in range(10):
+            base = scalarmult_B(random.getrandbits(256))
+            for T in torsion:
+                P = edwards_add(base, T)
+                expected = _affine(scalarmult(P, L)) == (0, 1)
+                self.assertEqual(_is_torsion_free(P), expected)
+            self.assertTrue(_is_torsion_free(base))
+        for T in torsion:
+            self.assertEqual(_is_torsion_free(T), T is IDENT)
+
+    def test_multi_scalarmult(self):
+        for i in range(10):
+            pairs = [(_random_point(), random.getrandbits(253)) for j in range(3)]
+            Q = IDENT
+            for P, k in pairs:
+                Q = edwards_add(Q, scalarmult(P, k))
+            self.assertEqual(_affine(_multi_scalarmult(pairs)), _affine(Q))
+
+    def test_batch_same_as_single(self):
+        tasks = _tasks(8)
+        self.assertEqual(_batch_verify(tasks, PREFIX), [_verify(*task, prefix=PREFIX) for task in tasks])
+        # broken S and R with small order point
+        torsion = _torsion_points()
+        pk, signature, txhash, msg = tasks[2]
+        tasks[2] = (pk, signature[:40] + bytes([signature[40] ^ 1]) + signature[41:], txhash, msg)
+        pk, signature, txhash, msg = tasks[5]
+        R = edwards_add(decodepoint(signature[:32]), torsion[4])
+        tasks[5] = (pk, encodepoint(R) + signature[32:], txhash, msg)
+        single = [_verify(*task, prefix=PREFIX) for task in tasks]
+        self.assertEqual(_batch_verify(tasks, PREFIX), single)
+        self.assertEqual([i for i, (pk, signature, txhash, address) in enumerate(single)
+                          if address.startswith('Failed')], [2, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
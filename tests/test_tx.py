@@ -0,0 +1,70 @@
+from bc4py.config import C
+import bc4py.chain.tx
+from bc4py.chain.tx import TX
+import unittest
+import pickle
+
+
+class _OldTX:
+    # TX slots before lazy decode
+    __slots__ = (
+        "b", "hash", "height", "pos_amount",
+        "version", "type", "time", "deadline", "inputs", "outputs",
+        "gas_price", "gas_amount", "message_type", "message",
+        "signature", "f_on_memory", "__weakref__")
+
+
+def _old_pickle(tx):
+    # pickle tx as baseline class wrote it
+    old = object.__new__(_OldTX)
+    for name in _OldTX.__slots__[:-1]:
+        setattr(old, name, getattr(tx, name))
+    _OldTX.__module__, _OldTX.__qualname__ = 'bc4py.chain.tx', 'TX'
+    bc4py.chain.tx.TX = _OldTX
+    try:
+        return pickle.dumps(old)
+    finally:
+        bc4py.chain.tx.TX = TX
+        _OldTX.__module__, _OldTX.__qualname__ = __name__, '_OldTX'
+
+
+def _new_tx():
+    return TX(tx={
+        'type': C.TX_TRANSFER,
+        'time': 100,
+        'deadline': 200,
+        'inputs': [(b'\x01' * 32, 0)],
+        'outputs': [('N' * 40, 0, 1000)],
+        'gas_price': 100,
+        'gas_amount': 1000,
+        'message_type': C.MSG_PLAIN,
+        'message': b'hello'})
+
+
+class TestTXPickle(unittest.TestCase):
+    def test_load_old_pickle(self):
+        tx = _new_tx()
+        tx.height = 10
+        b = _old_pickle(tx)
+        self.assertIn(b'inputs', b)
+        loaded = pickle.loads(b)
+        self.assertIsInstance(loaded, TX)
+        self.assertEqual(loaded.hash, tx.hash)
+        self.assertEqual(loaded.height, 10)
+        self.assertEqual(loaded.inputs, tx.inputs)
+        self.assertEqual(loaded.outputs, tx.outputs)
+        self.assertEqual(loaded.message, b'hello')
+        loaded.serialize()
+        self.assertEqual(loaded.b, tx.b)
+
+    def test_lazy_pickle(self):
+        tx = _new_tx()
+        lazy = TX(binary=tx.b, txhash=tx.hash)
+        loaded = pickle.loads(pickle.dumps(lazy))
+        self.assertEqual(loaded.inputs, tx.inputs)
+        self.assertEqual(loaded.outputs, tx.outputs)
+        self.assertEqual(loaded.message, b'hello')
+
+
+if __name__ == '__main__':
+    unittest.main()